@@ -23,11 +23,11 @@
 import os
 import argparse
 import cv2
-import numpy as np
 import sys
 import time
 from threading import Thread
 import importlib.util
+from tflitedetect import TFLiteDetector, filter_detections, boxes_to_pixels, centroids, non_max_suppression
 
 
 # Define VideoStream class to handle streaming of video from webcam in separate processing thread
@@ -100,19 +100,12 @@ resW, resH = args.resolution.split('x')
 imW, imH = int(resW), int(resH)
 use_TPU = args.edgetpu
 
-# Import TensorFlow libraries
-# If tflite_runtime is installed, import interpreter from tflite_runtime, else import from regular tensorflow
 # If using Coral Edge TPU, import the load_delegate library
-pkg = importlib.util.find_spec('tflite_runtime')
-if pkg:
-    from tflite_runtime.interpreter import Interpreter
-
-    if use_TPU:
+# (from tflite_runtime if installed, else from regular tensorflow)
+if use_TPU:
+    if importlib.util.find_spec('tflite_runtime'):
         from tflite_runtime.interpreter import load_delegate
-else:
-    from tensorflow.lite.python.interpreter import Interpreter
-
-    if use_TPU:
+    else:
         from tensorflow.lite.python.interpreter import load_delegate
 
 # If using Edge TPU, assign filename for Edge TPU model
@@ -143,24 +136,13 @@ if labels[0] == '???':
 # Load the Tensorflow Lite model.
 # If using Edge TPU, use special load_delegate argument
 if use_TPU:
-    interpreter = Interpreter(model_path=PATH_TO_CKPT,
-                              experimental_delegates=[load_delegate('libedgetpu.so.1.0')])
+    detector = TFLiteDetector(PATH_TO_CKPT, delegates=[load_delegate('libedgetpu.so.1.0')])
     print(PATH_TO_CKPT)
 else:
-    interpreter = Interpreter(model_path=PATH_TO_CKPT)
+    detector = TFLiteDetector(PATH_TO_CKPT)
 
-interpreter.allocate_tensors()
-
-# Get model details
-input_details = interpreter.get_input_details()
-output_details = interpreter.get_output_details()
-height = input_details[0]['shape'][1]
-width = input_details[0]['shape'][2]
-
-floating_model = (input_details[0]['dtype'] == np.float32)
-
-input_mean = 127.5
-input_std = 127.5
+# Overlapping boxes of the same object are merged above this IoU
+NMS_IOU_THRESHOLD = 0.5
 
 # Initialize frame rate calculation
 frame_rate_calc = 1
@@ -182,56 +164,44 @@ while True:
     # Grab frame from video stream
     frame1 = videostream.read()
 
-    # Acquire frame and resize to expected shape [1xHxWx3]
+    # Acquire frame; the detector resizes it into the model's input tensor
     frame = frame1.copy()
     frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    frame_resized = cv2.resize(frame_rgb, (width, height))
-    input_data = np.expand_dims(frame_resized, axis=0)
-
-    # Normalize pixel values if using a floating model (i.e. if model is non-quantized)
-    if floating_model:
-        input_data = (np.float32(input_data) - input_mean) / input_std
 
     # Perform the actual detection by running the model with the image as input
-    interpreter.set_tensor(input_details[0]['index'], input_data)
-    interpreter.invoke()
-
-    # Retrieve detection results
-    boxes = interpreter.get_tensor(output_details[0]['index'])[0]  # Bounding box coordinates of detected objects
-    classes = interpreter.get_tensor(output_details[1]['index'])[0]  # Class index of detected objects
-    scores = interpreter.get_tensor(output_details[2]['index'])[0]  # Confidence of detected objects
-    # inaccurate and not needed)
-
-    # Loop over all detections and draw detection box if confidence is above minimum threshold
-    for i in range(len(scores)):
-        if ((scores[i] > min_conf_threshold) and (scores[i] <= 1.0)):
-            # Get bounding box coordinates and draw box
-            # Interpreter can return coordinates that are outside of image dimensions, need to force them to be within image using max() and min()
-            ymin = int(max(1, (boxes[i][0] * imH)))
-            xmin = int(max(1, (boxes[i][1] * imW)))
-            ymax = int(min(imH, (boxes[i][2] * imH)))
-            xmax = int(min(imW, (boxes[i][3] * imW)))
-
-            cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (10, 255, 0), 2)
-
-            # Draw label
-            object_name = labels[int(classes[i])]  # Look up object name from "labels" array using class index
-            label = '%s: %d%%' % (object_name, int(scores[i] * 100))  # Example: 'person: 72%'
-            labelSize, baseLine = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)  # Get font size
-            label_ymin = max(ymin, labelSize[1] + 10)  # Make sure not to draw label too close to top of window
-            cv2.rectangle(frame, (xmin, label_ymin - labelSize[1] - 10),
-                          (xmin + labelSize[0], label_ymin + baseLine - 10), (255, 255, 255),
-                          cv2.FILLED)  # Draw white box to put label text in
-            cv2.putText(frame, label, (xmin, label_ymin - 7), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0),
-                        2)  # Draw label text
-
-            # Draw circle in center
-            xcenter = xmin + (int(round((xmax - xmin) / 2)))
-            ycenter = ymin + (int(round((ymax - ymin) / 2)))
-            cv2.circle(frame, (xcenter, ycenter), 5, (0, 0, 255), thickness=-1)
-
-            # Print info
-            print('Object ' + str(i) + ': ' + object_name + ' at (' + str(xcenter) + ', ' + str(ycenter) + ')')
+    detector.set_input(frame_rgb)
+    detector.invoke()
+
+    # Retrieve detection results above the confidence threshold as arrays, convert them
+    # to pixels (clipped to the image) and drop overlapping duplicates, all at once
+    boxes, classes, scores, count = detector.outputs()
+    boxes, classes, scores = filter_detections(boxes, classes, scores, count, min_conf_threshold)
+    pixel_boxes = boxes_to_pixels(boxes, (imW, imH))
+    keep = non_max_suppression(pixel_boxes, scores, NMS_IOU_THRESHOLD)
+    centers = centroids(pixel_boxes)
+
+    # Draw a box for every detection that is left
+    for i in keep:
+        xmin, ymin, xmax, ymax = (int(v) for v in pixel_boxes[i])
+        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (10, 255, 0), 2)
+
+        # Draw label
+        object_name = labels[int(classes[i])]  # Look up object name from "labels" array using class index
+        label = '%s: %d%%' % (object_name, int(scores[i] * 100))  # Example: 'person: 72%'
+        labelSize, baseLine = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)  # Get font size
+        label_ymin = max(ymin, labelSize[1] + 10)  # Make sure not to draw label too close to top of window
+        cv2.rectangle(frame, (xmin, label_ymin - labelSize[1] - 10),
+                      (xmin + labelSize[0], label_ymin + baseLine - 10), (255, 255, 255),
+                      cv2.FILLED)  # Draw white box to put label text in
+        cv2.putText(frame, label, (xmin, label_ymin - 7), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0),
+                    2)  # Draw label text
+
+        # Draw circle in center
+        xcenter, ycenter = (int(v) for v in centers[i])
+        cv2.circle(frame, (xcenter, ycenter), 5, (0, 0, 255), thickness=-1)
+
+        # Print info
+        print('Object ' + str(i) + ': ' + object_name + ' at (' + str(xcenter) + ', ' + str(ycenter) + ')')
 
     # Draw framerate in corner of frame
     cv2.putText(frame, 'FPS: {0:.2f}'.format(frame_rate_calc), (30, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 0), 2,
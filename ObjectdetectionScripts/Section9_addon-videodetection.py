@@ -1,87 +1,123 @@
 import os
 import cv2
+import queue
+import threading
 import numpy as np
 import tensorflow as tf
+from concurrent.futures import ThreadPoolExecutor
 from object_detection.utils import label_map_util, visualization_utils as viz_utils
 
 # Load label map
 category_index = label_map_util.create_category_index_from_labelmap(files['LABELMAP'])
 
 # Paths
-video_name = 'test1.mp4'
-video_path = os.path.join(paths['IMAGE_PATH'], 'test', video_name)
+video_names = ['test1.mp4']
+video_folder = os.path.join(paths['IMAGE_PATH'], 'test')
 output_folder = os.path.join(paths['IMAGE_PATH'], 'visualfeedback')
 os.makedirs(output_folder, exist_ok=True)
 
-# Output video paths
-resized_video_path = os.path.join(output_folder, video_name.replace('.mp4', '_RS.mp4'))
-annotated_video_path = os.path.join(output_folder, video_name.replace('.mp4', '_RS_annotated.mp4'))
+# Frames are cropped to the arena and resized to the model input in memory,
+# then sent to detect_fn BATCH_SIZE at a time
+CROP_X = 80                 # pixels cropped from left and right (640 -> 480)
+INPUT_SIZE = (320, 320)
+BATCH_SIZE = 8              # 1 if the model was exported for single images
+WRITE_QUEUE_SIZE = 4        # batches waiting for the writer thread
+CONCURRENT_VIDEOS = 1       # >1 runs several videos at once (decode/encode use the other cores)
+MIN_SCORE = 0.8
 
-# Open original video
-cap = cv2.VideoCapture(video_path)
-fps = cap.get(cv2.CAP_PROP_FPS)
 
-# Define video writer for resized video
-fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-resized_writer = cv2.VideoWriter(resized_video_path, fourcc, fps, (320, 320))
+def annotation_writer(writer, batches, errors):
+    """Draws the detections on each frame and writes it; runs in its own thread.
 
-# Step 1: Crop and resize original video
-while cap.isOpened():
-    ret, frame = cap.read()
-    if not ret:
-        break
+    An exception is recorded in errors and the queue is drained (without
+    drawing) until the closing None, so the decode loop never blocks on it.
+    """
+    try:
+        write_annotated(writer, batches)
+    except BaseException as e:
+        errors.append(e)
+        while batches.get() is not None:
+            pass
 
-    # Crop 80 pixels from left and right (assumes original width is 640)
-    cropped_frame = frame[:, 80:-80]  # Resulting in 480x480
 
-    # Resize to 320x320
-    resized_frame = cv2.resize(cropped_frame, (320, 320))
-
-    # Write resized frame
-    resized_writer.write(resized_frame)
-
-cap.release()
-resized_writer.release()
-
-# Step 2: Analyze the resized video
-cap_rs = cv2.VideoCapture(resized_video_path)
-annotated_writer = cv2.VideoWriter(annotated_video_path, fourcc, fps, (320, 320))
-
-while cap_rs.isOpened():
-    ret, frame = cap_rs.read()
-    if not ret:
-        break
-
-    image_np = np.array(frame)
-    input_tensor = tf.convert_to_tensor(np.expand_dims(image_np, 0), dtype=tf.float32)
-
-    # Run detection
-    detections = detect_fn(input_tensor)
-
-    # Process detections
-    num_detections = int(detections.pop('num_detections'))
-    detections = {key: value[0, :num_detections].numpy()
-                  for key, value in detections.items()}
-    detections['num_detections'] = num_detections
-    detections['detection_classes'] = detections['detection_classes'].astype(np.int64)
-
-    # Visualize results
+def write_annotated(writer, batches):
     label_id_offset = 1
-    image_np_with_detections = image_np.copy()
-
-    viz_utils.visualize_boxes_and_labels_on_image_array(
-        image_np_with_detections,
-        detections['detection_boxes'],
-        detections['detection_classes'] + label_id_offset,
-        detections['detection_scores'],
-        category_index,
-        use_normalized_coordinates=True,
-        max_boxes_to_draw=5,
-        min_score_thresh=0.8,
-        agnostic_mode=False)
-
-    # Write annotated frame
-    annotated_writer.write(image_np_with_detections)
-
-cap_rs.release()
-annotated_writer.release()
\ No newline at end of file
+    while True:
+        item = batches.get()
+        if item is None:
+            break
+        frames, detections = item
+        for i, image_np_with_detections in enumerate(frames):
+            num_detections = int(detections['num_detections'][i])
+            viz_utils.visualize_boxes_and_labels_on_image_array(
+                image_np_with_detections,
+                detections['detection_boxes'][i, :num_detections],
+                detections['detection_classes'][i, :num_detections].astype(np.int64) + label_id_offset,
+                detections['detection_scores'][i, :num_detections],
+                category_index,
+                use_normalized_coordinates=True,
+                max_boxes_to_draw=5,
+                min_score_thresh=MIN_SCORE,
+                agnostic_mode=False)
+
+            # Write annotated frame
+            writer.write(image_np_with_detections)
+
+
+def detect_video(video_name):
+    """Decodes a video once, runs detection on cropped/resized frames in batches
+    and writes <name>_RS_annotated.mp4; no intermediate _RS.mp4 is written."""
+    video_path = os.path.join(video_folder, video_name)
+    annotated_video_path = os.path.join(output_folder, video_name.replace('.mp4', '_RS_annotated.mp4'))
+
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    annotated_writer = cv2.VideoWriter(annotated_video_path, fourcc, fps, INPUT_SIZE)
+
+    batches = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    writer_errors = []
+    writer_thread = threading.Thread(target=annotation_writer, args=(annotated_writer, batches, writer_errors))
+    writer_thread.start()
+
+    batch = np.empty((BATCH_SIZE, INPUT_SIZE[1], INPUT_SIZE[0], 3), np.uint8)
+    frame_count = 0
+    try:
+        while True:
+            filled = 0
+            while filled < BATCH_SIZE:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                # Crop to the arena and resize straight into the batch
+                cv2.resize(frame[:, CROP_X:-CROP_X], INPUT_SIZE, dst=batch[filled])
+                filled += 1
+            if not filled:
+                break
+
+            # Run detection on the whole batch
+            input_tensor = tf.convert_to_tensor(batch[:filled], dtype=tf.float32)
+            detections = detect_fn(input_tensor)
+            detections = {key: value.numpy() for key, value in detections.items()}
+
+            # The writer draws on its own copy, so the batch buffer can be refilled
+            batches.put((batch[:filled].copy(), detections))
+            frame_count += filled
+            if filled < BATCH_SIZE or writer_errors:
+                break
+    finally:
+        batches.put(None)
+        writer_thread.join()
+        cap.release()
+        annotated_writer.release()
+    if writer_errors:
+        raise RuntimeError(f"Writing {annotated_video_path} failed") from writer_errors[0]
+    print(f"{video_name}: {frame_count} frames -> {annotated_video_path}")
+    return annotated_video_path
+
+
+if CONCURRENT_VIDEOS > 1:
+    with ThreadPoolExecutor(max_workers=CONCURRENT_VIDEOS) as pool:
+        annotated_videos = list(pool.map(detect_video, video_names))
+else:
+    annotated_videos = [detect_video(video_name) for video_name in video_names]
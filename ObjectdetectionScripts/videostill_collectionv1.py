@@ -1,76 +1,241 @@
 import cv2
 import os
+import csv
 import random
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # Set the path to the directory containing your videos
 video_directory = "videos"  # Change this to your actual video directory
-output_directory = "collectedimages"
-
-# Create the output directory if it doesn't exist
-os.makedirs(output_directory, exist_ok=True)
+resized_directory = "resized"
 
 # Supported video file extensions
 video_extensions = ['.mp4', '.avi', '.mov', '.mkv']
 
-# Initialize image counter
-image_counter = 1
-
-# Iterate through all files in the video directory
-for filename in os.listdir(video_directory):
-    if any(filename.lower().endswith(ext) for ext in video_extensions):
-        video_path = os.path.join(video_directory, filename)
-        cap = cv2.VideoCapture(video_path)
-
-        if not cap.isOpened():
-            print(f"Failed to open video: {filename}")
-            continue
-
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-
-        # Generate 50 unique random frame indices
-        random_frames = sorted(random.sample(range(frame_count), min(50, frame_count)))
-
-        for frame_num in random_frames:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
-            ret, frame = cap.read()
-            if ret:
-                image_filename = f"rodent_{image_counter}.jpg"
-                image_path = os.path.join(output_directory, image_filename)
-                cv2.imwrite(image_path, frame)
-                image_counter += 1
-
+FRAMES_PER_VIDEO = 50
+CROP_X = 80                 # pixels cropped from each side
+RESIZE_DIM = (320, 320)
+WORKERS = os.cpu_count()
+
+# Videos that have been fully sampled; re-runs skip them
+DONE_FILE = os.path.join(resized_directory, "sampled_videos.txt")
+
+# Smart sampling: spread each video's frames over arena zones (from the
+# tracker's <...>_log.csv next to the video) and activity levels, and drop
+# near-duplicates of anything already in the dataset
+SMART_SAMPLING = True
+MOTION_LEVELS = (1.0, 4.0)  # mean abs frame difference separating rest / slow / active
+CANDIDATES_PER_BUCKET = 6   # reservoir kept per (zone, activity) bucket
+HASH_DISTANCE = 6           # dHash bits; closer images count as duplicates
+HASH_INDEX_FILE = os.path.join(resized_directory, "phash_index.npy")
+CENTER_ZONE = 7             # bucket used for frames logged in the centre
+
+
+def sample_video(filename):
+    """Decodes a video front to back once, keeping FRAMES_PER_VIDEO random frames.
+
+    Unwanted frames are only grab()bed (no conversion), selected ones are
+    retrieve()d, cropped and resized in memory and written once as
+    rodent_<video>_<frame>.jpg. The frame choice is seeded by the file name,
+    so a re-run after an interruption picks the same frames.
+    """
+    video_path = os.path.join(video_directory, filename)
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Failed to open video: {filename}")
+        return filename, None
+
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    if width < 2 * CROP_X:
+        print(f"Video too small to crop: {filename}")
         cap.release()
-
-print(f"Extraction complete. {image_counter - 1} images saved in '{output_directory}' directory.")
-
-
-# === Step 2: Crop and resize images ===
-
-resized_directory = "resized"
-os.makedirs(resized_directory, exist_ok=True)
-
-for filename in os.listdir(output_directory):
-    if filename.lower().endswith('.jpg'):
-        image_path = os.path.join(output_directory, filename)
-        image = cv2.imread(image_path)
-
-        if image is None:
-            print(f"Failed to read image: {filename}")
-            continue
-
-        height, width, _ = image.shape
-        if height < 160 or width < 160:
-            print(f"Image too small to crop: {filename}")
-            continue
-
-        # Crop 80 pixels from each side
-        cropped_image = image[:, 80:width-80]
-
-        # Resize to 300x300 pixels
-        resized_image = cv2.resize(cropped_image, (320, 320))
-
-        # Save the resized image
-        resized_path = os.path.join(resized_directory, filename)
-        cv2.imwrite(resized_path, resized_image)
-
-print(f"Cropping and resizing complete. Images saved in '{resized_directory}' directory.")
+        return filename, None
+
+    # Generate unique random frame indices
+    rng = random.Random(filename)
+    wanted = set(rng.sample(range(frame_count), min(FRAMES_PER_VIDEO, frame_count)))
+    last_wanted = max(wanted, default=-1)
+    stem = os.path.splitext(filename)[0]
+
+    saved = 0
+    frame_num = 0
+    while frame_num <= last_wanted and cap.grab():
+        if frame_num in wanted:
+            image_path = os.path.join(resized_directory, f"rodent_{stem}_{frame_num:06d}.jpg")
+            if not os.path.exists(image_path):
+                ret, frame = cap.retrieve()
+                if ret:
+                    resized_image = cv2.resize(frame[:, CROP_X:width - CROP_X], RESIZE_DIM)
+                    cv2.imwrite(image_path, resized_image)
+            saved += 1
+        frame_num += 1
+
+    cap.release()
+    return filename, saved
+
+
+def dhash(image):
+    """64-bit difference hash of a BGR image."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+class HashIndex:
+    """Perceptual hashes of every image in the dataset, saved between runs."""
+
+    def __init__(self, path):
+        self.path = path
+        self.hashes = np.load(path) if os.path.exists(path) else np.empty(0, np.uint64)
+
+    def is_duplicate(self, image_hash):
+        if not len(self.hashes):
+            return False
+        differing = np.bitwise_xor(self.hashes, np.uint64(image_hash))
+        distances = np.unpackbits(differing.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+        return bool(distances.min() <= HASH_DISTANCE)
+
+    def add(self, image_hash):
+        self.hashes = np.append(self.hashes, np.uint64(image_hash))
+
+    def save(self):
+        np.save(self.path, self.hashes)
+
+
+def load_zones(filename):
+    """Zone of every frame from the tracker log for a video (frame n -> row n),
+    with CENTER_ZONE for frames in the centre; None if there is no log.
+    Retrack15 numbers frames from 1 in every session."""
+    stem, _ = os.path.splitext(filename)
+    log_path = os.path.join(video_directory, stem.rsplit("_video", 1)[0] + "_log.csv")
+    if not os.path.exists(log_path):
+        return None
+    zones = {}
+    with open(log_path, newline='') as f:
+        for row in csv.DictReader(f):
+            zone = int(row["Piezone"])
+            zones[int(row["Frame"]) - 1] = CENTER_ZONE if row["InCenter"] == "True" else zone
+    return zones
+
+
+def smart_sample_video(filename):
+    """Streams a video once and returns candidate frames spread over
+    (zone, activity) buckets as (bucket, frame_num, dhash, jpeg bytes).
+
+    Every frame is decoded so its motion score (mean abs difference to the
+    previous frame at 80x60) can be measured; each bucket keeps a seeded
+    reservoir of CANDIDATES_PER_BUCKET cropped/resized frames. The final
+    choice and deduplication happen in the main process.
+    """
+    video_path = os.path.join(video_directory, filename)
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Failed to open video: {filename}")
+        return filename, None
+
+    zones = load_zones(filename) or {}
+    rng = random.Random(filename)
+    reservoirs = {}
+    seen = {}
+    previous = None
+    frame_num = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if frame.shape[1] < 2 * CROP_X:
+            print(f"Video too small to crop: {filename}")
+            cap.release()
+            return filename, None
+        thumb = cv2.cvtColor(cv2.resize(frame, (80, 60), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        motion = 0.0 if previous is None else float(cv2.absdiff(thumb, previous).mean())
+        previous = thumb
+        level = sum(motion > threshold for threshold in MOTION_LEVELS)
+        bucket = (zones.get(frame_num, 0), level)
+
+        # Reservoir sampling per bucket
+        count = seen.get(bucket, 0) + 1
+        seen[bucket] = count
+        reservoir = reservoirs.setdefault(bucket, [])
+        slot = len(reservoir) if len(reservoir) < CANDIDATES_PER_BUCKET else rng.randrange(count)
+        if slot < CANDIDATES_PER_BUCKET:
+            resized_image = cv2.resize(frame[:, CROP_X:frame.shape[1] - CROP_X], RESIZE_DIM)
+            candidate = (frame_num, resized_image)
+            if slot == len(reservoir):
+                reservoir.append(candidate)
+            else:
+                reservoir[slot] = candidate
+        frame_num += 1
+    cap.release()
+
+    candidates = []
+    for bucket, reservoir in reservoirs.items():
+        for candidate_frame, resized_image in reservoir:
+            _, jpeg = cv2.imencode(".jpg", resized_image)
+            candidates.append((bucket, candidate_frame, dhash(resized_image), jpeg.tobytes()))
+    return filename, candidates
+
+
+def select_candidates(filename, candidates, index):
+    """Takes up to FRAMES_PER_VIDEO candidates round-robin over the buckets,
+    skipping near-duplicates of the index, and writes them."""
+    by_bucket = {}
+    for candidate in candidates:
+        by_bucket.setdefault(candidate[0], []).append(candidate)
+    stem = os.path.splitext(filename)[0]
+    saved = 0
+    while saved < FRAMES_PER_VIDEO and by_bucket:
+        for bucket in sorted(by_bucket):
+            if saved >= FRAMES_PER_VIDEO:
+                break
+            _, frame_num, image_hash, jpeg = by_bucket[bucket].pop()
+            if not by_bucket[bucket]:
+                del by_bucket[bucket]
+            if index.is_duplicate(image_hash):
+                continue
+            image_path = os.path.join(resized_directory, f"rodent_{stem}_{frame_num:06d}.jpg")
+            with open(image_path, "wb") as f:
+                f.write(jpeg)
+            index.add(image_hash)
+            saved += 1
+    return saved
+
+
+def load_done():
+    if not os.path.exists(DONE_FILE):
+        return set()
+    with open(DONE_FILE) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def main():
+    os.makedirs(resized_directory, exist_ok=True)
+    done = load_done()
+    videos = [filename for filename in sorted(os.listdir(video_directory))
+              if any(filename.lower().endswith(ext) for ext in video_extensions) and filename not in done]
+    print(f"{len(videos)} videos to sample ({len(done)} already done)")
+
+    index = HashIndex(HASH_INDEX_FILE) if SMART_SAMPLING else None
+    sampler = smart_sample_video if SMART_SAMPLING else sample_video
+    image_counter = 0
+    with ProcessPoolExecutor(max_workers=WORKERS) as pool, open(DONE_FILE, "a") as done_file:
+        futures = [pool.submit(sampler, filename) for filename in videos]
+        for future in as_completed(futures):
+            filename, saved = future.result()
+            if saved is None:
+                continue
+            if SMART_SAMPLING:
+                saved = select_candidates(filename, saved, index)
+                index.save()
+            image_counter += saved
+            done_file.write(filename + "\n")
+            done_file.flush()
+            print(f"{filename}: {saved} images")
+
+    print(f"Extraction complete. {image_counter} images saved in '{resized_directory}' directory.")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,8 +7,11 @@ import time
 import datetime
 import csv
 import threading
+import argparse
 import RPi.GPIO as GPIO
 from picamera2 import Picamera2, Preview
+from picamera2.encoders import H264Encoder
+from sessioncontrol import SessionControl
 
 # Constants
 WIDTH, HEIGHT = 640, 480
@@ -25,6 +28,11 @@ cam5 = 24
 cam6 = 25
 lens_pos = 0
 
+# Record with the hardware H.264 encoder on the main stream; the preview uses the lores stream
+HARDWARE_ENCODE = False
+RECORD_WIDTH, RECORD_HEIGHT = 1280, 960
+RECORD_BITRATE = 10000000
+
 zone = 99
 center = 66
 
@@ -73,7 +81,12 @@ def stop_led_thread():
 def initialize_camera():
     picam2 = Picamera2()
     picam2.start_preview(Preview.NULL)
-    cfg = picam2.create_preview_configuration(main={"format": "BGR888", "size": (WIDTH, HEIGHT)})
+    if HARDWARE_ENCODE:
+        cfg = picam2.create_video_configuration(main={"size": (RECORD_WIDTH, RECORD_HEIGHT)},
+                                                lores={"format": "YUV420", "size": (WIDTH, HEIGHT)},
+                                                controls={"FrameRate": FPS})
+    else:
+        cfg = picam2.create_preview_configuration(main={"format": "BGR888", "size": (WIDTH, HEIGHT)})
     picam2.configure(cfg)
     picam2.set_controls({
         "AfMode": 0,
@@ -83,30 +96,72 @@ def initialize_camera():
     time.sleep(2)
     return picam2
 
+def capture_frame(picam2):
+    if HARDWARE_ENCODE:
+        return cv2.cvtColor(picam2.capture_array("lores"), cv2.COLOR_YUV420p2BGR)
+    return picam2.capture_array()
+
+def open_video(picam2, base_time, sample_number, session_number):
+    """Starts the session video. Returns a VideoWriter, or None when the hardware encoder is recording."""
+    if HARDWARE_ENCODE:
+        video_filename = generate_filename(base_time, sample_number, session_number, "video.h264")
+        pts_filename = generate_filename(base_time, sample_number, session_number, "pts.txt")
+        picam2.start_encoder(H264Encoder(bitrate=RECORD_BITRATE), video_filename, pts=pts_filename)
+        print(f"Started new video file: {video_filename}")
+        return None
+    video_filename = generate_filename(base_time, sample_number, session_number, "video.mp4")
+    print(f"Started new video file: {video_filename}")
+    return cv2.VideoWriter(video_filename, cv2.VideoWriter_fourcc(*'mp4v'), FPS, (WIDTH, HEIGHT))
+
+def close_video(picam2, video_writer):
+    if HARDWARE_ENCODE:
+        picam2.stop_encoder()
+    elif video_writer:
+        video_writer.release()
+
 def generate_filename(base_time, sample_number, session_number, suffix):
     timestamp = base_time.strftime("%Y%m%d_%H%M%S")
     return f"{timestamp}_Sample{sample_number}_Session{session_number}_{suffix}"
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--headless', action='store_true',
+                        help='No preview window; start/pause/resume/quit are read from stdin')
+    parser.add_argument('--socket', help='Also accept start/pause/resume/quit on this UNIX socket')
+    parser.add_argument('--preview-fps', type=float,
+                        help='Limit the preview to this many frames per second (shows a preview even when headless)')
+    args = parser.parse_args()
+    preview_fps = args.preview_fps
+    if args.headless and preview_fps is None:
+        preview_fps = 0
+
     base_time = datetime.datetime.now()
     sample_number = input("Enter sample number: ")
+    # stdin is only handed to the command reader after the sample number prompt
+    commands = SessionControl(preview_fps, stdin=args.headless, socket_path=args.socket)
     session_number = 1
 
     picam2 = initialize_camera()
-    print("Press spacebar to start tracking...")
+    print("Press spacebar (or send 'start') to start tracking...")
     while True:
-        frame = picam2.capture_array()
+        frame = capture_frame(picam2)
         cv2.putText(frame, "Press SPACE to start", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-        cv2.imshow("Camera Feed", frame)
-        if cv2.waitKey(1) & 0xFF == ord(' '):
+        command = commands.poll(frame)
+        if command == "start":
             break
+        if command == "quit":
+            commands.close()
+            GPIO.cleanup()
+            cv2.destroyAllWindows()
+            picam2.stop()
+            return
 
 
     paused = False
 
-    video_filename = generate_filename(base_time, sample_number, session_number, "video.mp4")
+    recording = True
+    video_writer = open_video(picam2, base_time, sample_number, session_number)
     log_filename = generate_filename(base_time, sample_number, session_number, "log.csv")
-    video_writer = cv2.VideoWriter(video_filename, cv2.VideoWriter_fourcc(*'mp4v'), FPS, (WIDTH, HEIGHT))
     log_file = open(log_filename, mode='w', newline='')
     log_writer = csv.writer(log_file)
     log_writer.writerow(["Frame", "Timestamp", "LED state", "InCenter", "FPS", "Camera"])
@@ -127,7 +182,7 @@ def main():
     cameratriggered = 0
 
     while True:
-        frame = picam2.capture_array()
+        frame = capture_frame(picam2)
 
         timestamp = datetime.datetime.now()
         frame_count += 1
@@ -143,20 +198,20 @@ def main():
             if video_writer:
                 video_writer.write(frame)
 
-        cv2.imshow("Tracking", frame)
-        key = cv2.waitKey(1) & 0xFF
+        command = commands.poll(frame)
 
-        if key == ord('q'):
+        if command == "quit":
             break
 
-        elif key == ord('m'):
+        elif command == "pause" and not paused:
             paused = True
             print("Paused tracking and recording.")
 
             # Stop and save current video
-            if video_writer:
-                video_writer.release()
+            if recording:
+                close_video(picam2, video_writer)
                 video_writer = None
+                recording = False
                 GPIO.output(cam1, GPIO.LOW)
                 GPIO.output(cam2, GPIO.LOW)
                 GPIO.output(cam3, GPIO.LOW)
@@ -175,7 +230,7 @@ def main():
 
             stop_led_thread()
 
-        elif key == ord('c') and paused:
+        elif command == "resume" and paused:
             paused = False
             session_number += 1
             tracking = False
@@ -183,9 +238,8 @@ def main():
             print("Resumed tracking and recording.")
 
             # Start a new video file
-            video_filename = generate_filename(base_time, sample_number, session_number, "video.mp4")
-            video_writer = cv2.VideoWriter(video_filename, cv2.VideoWriter_fourcc(*'mp4v'), FPS, (WIDTH, HEIGHT))
-            print(f"Started new video file: {video_filename}")
+            video_writer = open_video(picam2, base_time, sample_number, session_number)
+            recording = True
 
             # Start a new log file
             log_filename = generate_filename(base_time, sample_number, session_number, "log.csv")
@@ -206,8 +260,8 @@ def main():
 
         previous_frame = frame.copy()
 
-    if video_writer:
-        video_writer.release()
+    if recording:
+        close_video(picam2, video_writer)
     cameratriggered = 1111
     log_writer.writerow([frame_count, timestamp.strftime("%H:%M:%S.%f"), zone, center, round(fps, 2), cameratriggered])
     if log_file:
@@ -215,6 +269,7 @@ def main():
     stop_led_thread()
     GPIO.cleanup()
     cv2.destroyAllWindows()
+    commands.close()
     picam2.stop()
 
 if __name__ == "__main__":
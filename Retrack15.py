@@ -5,10 +5,29 @@ import cv2
 import numpy as np
 import time
 import datetime
-import csv
 import threading
-import RPi.GPIO as GPIO
-from picamera2 import Picamera2, Preview
+import argparse
+from framequeue import FrameQueue, LATEST, LOSSLESS
+from arena import ArenaMap
+from framesource import PicameraSource, VideoCaptureSource, ReplaySource
+from camtrigger import CameraTrigger, BOX_LAYOUTS
+from sessionlog import SessionLog
+from sessioncontrol import SessionControl
+from motiondetect import create_detector, DETECTORS
+from trackerengines import AdaptiveTracker, TRACKERS
+from kalmansearch import CentroidKalman
+
+# Off the Pi (replaying recorded sessions on a workstation) there is no camera
+# and the arm camera pins are simply not driven
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None
+try:
+    from picamera2 import Picamera2, Preview
+    from picamera2.encoders import H264Encoder
+except ImportError:
+    Picamera2 = None
 
 # Constants
 WIDTH, HEIGHT = 640, 480
@@ -27,23 +46,59 @@ cam4 = 23
 cam5 = 24
 cam6 = 25
 lens_pos = 0
+EXPORT_CSV = True     # also write the session log as CSV when a session ends
+BOX_LAYOUT = "2arm"   # zone -> camera table in camtrigger.BOX_LAYOUTS ("6arm" for the 6 arm box)
+
+# Pipelined mode: capture, analysis and recording run in separate threads
+PIPELINED = True
+ANALYSIS_QUEUE_SIZE = 2    # latest-wins, stale frames are dropped
+RECORD_QUEUE_SIZE = 96     # lossless, ~4 s of frames at 24 fps
+DISPLAY_QUEUE_SIZE = 1     # latest-wins
+
+# Per-frame zone/tracking messages on stdout (benchmark.py turns them off)
+VERBOSE = True
+
+# Motion detection on the Y plane of a YUV420 lores stream instead of converting BGR to gray
+DETECT_ON_LUMA = True
+
+# Motion detection only looks inside the arena hexagon, at this pyramid level
+# (0 = full resolution, 1 = half, 2 = quarter)
+DETECT_LEVEL = 1
+
+# Motion detector engine (motiondetect.DETECTORS): "diff" (two-frame differencing),
+# "mog2"/"knn" (background models, also find a resting animal) or "average" (running average)
+MOTION_ENGINE = "diff"
+
+# Tracker engine (trackerengines.TRACKERS). With ADAPTIVE_TRACKER the tracker steps down
+# TRACKER_LADDER when updates take longer than TRACK_BUDGET_MS and back up when there is headroom
+TRACKER_ENGINE = "kcf"
+ADAPTIVE_TRACKER = True
+TRACKER_LADDER = ["csrt", "kcf", "mosse"]
+TRACK_BUDGET_MS = 0.5 * 1000 / FPS
+
+# After a tracker dropout, re-detect only in a window around the Kalman-predicted
+# position and keep logging the predicted zone for up to MAX_COAST_FRAMES
+MAX_COAST_FRAMES = FPS // 2
+SEARCH_HALF_SIZE = 80      # pixels, grows by SEARCH_GROWTH for every frame spent coasting
+SEARCH_GROWTH = 10
+
+# Which video to record: "raw" (clean camera frames), "annotated" (zones, bbox, FPS) or "both"
+RECORD_STREAM = "raw"
+
+# Record the raw stream with the hardware H.264 encoder on the main stream and
+# run detection/tracking on a WIDTH x HEIGHT lores stream
+HARDWARE_ENCODE = False
+RECORD_WIDTH, RECORD_HEIGHT = 1280, 960
+RECORD_BITRATE = 10000000
+
+# Zone of every pixel, computed once instead of per frame
+ARENA = ArenaMap.hexagonal(WIDTH, HEIGHT, CENTER_RADIUS, NO_TRACKING_MARGIN)
 
 # GPIO setup
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(LED_PIN, GPIO.OUT)
-GPIO.setup(cam1, GPIO.OUT)
-GPIO.setup(cam2, GPIO.OUT)
-GPIO.setup(cam3, GPIO.OUT)
-GPIO.setup(cam4, GPIO.OUT)
-GPIO.setup(cam5, GPIO.OUT)
-GPIO.setup(cam6, GPIO.OUT)
-
-GPIO.output(cam1, GPIO.LOW)
-GPIO.output(cam2, GPIO.LOW)
-GPIO.output(cam3, GPIO.LOW)
-GPIO.output(cam4, GPIO.LOW)
-GPIO.output(cam5, GPIO.LOW)
-GPIO.output(cam6, GPIO.LOW)
+if GPIO:
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(LED_PIN, GPIO.OUT)
+CAMERAS = CameraTrigger(GPIO, [cam1, cam2, cam3, cam4, cam5, cam6], BOX_LAYOUTS[BOX_LAYOUT])
 
 # LED flashing thread control
 led_thread = None
@@ -59,6 +114,8 @@ def led_flashing():
 
 def start_led_thread():
     global led_thread, led_thread_running
+    if GPIO is None:
+        return
     led_thread_running = True
     led_thread = threading.Thread(target=led_flashing)
     led_thread.start()
@@ -66,14 +123,24 @@ def start_led_thread():
 def stop_led_thread():
     global led_thread_running
     led_thread_running = False
-    GPIO.output(LED_PIN, GPIO.LOW)
+    if GPIO:
+        GPIO.output(LED_PIN, GPIO.LOW)
     if led_thread:
         led_thread.join()
 
 def initialize_camera():
     picam2 = Picamera2()
     picam2.start_preview(Preview.NULL)
-    cfg = picam2.create_preview_configuration(main={"format": "BGR888", "size": (WIDTH, HEIGHT)})
+    if HARDWARE_ENCODE:
+        # lores has to be YUV420; it is converted to BGR for the tracker in capture_frame
+        cfg = picam2.create_video_configuration(main={"size": (RECORD_WIDTH, RECORD_HEIGHT)},
+                                                lores={"format": "YUV420", "size": (WIDTH, HEIGHT)},
+                                                controls={"FrameRate": FPS})
+    elif DETECT_ON_LUMA:
+        cfg = picam2.create_preview_configuration(main={"format": "BGR888", "size": (WIDTH, HEIGHT)},
+                                                  lores={"format": "YUV420", "size": (WIDTH, HEIGHT)})
+    else:
+        cfg = picam2.create_preview_configuration(main={"format": "BGR888", "size": (WIDTH, HEIGHT)})
     picam2.configure(cfg)
     picam2.set_controls({
         "AfMode": 0,
@@ -83,7 +150,20 @@ def initialize_camera():
     time.sleep(2)
     return picam2
 
-def draw_zones(frame):
+def capture_frame(picam2):
+    """Returns the BGR frame and its grayscale version (the lores Y plane), or None if DETECT_ON_LUMA is off."""
+    if HARDWARE_ENCODE:
+        yuv = picam2.capture_array("lores")
+        return cv2.cvtColor(yuv, cv2.COLOR_YUV420p2BGR), yuv[:HEIGHT, :WIDTH]
+    if not DETECT_ON_LUMA:
+        return picam2.capture_array(), None
+    (frame, yuv), _ = picam2.capture_arrays(["main", "lores"])
+    # The first HEIGHT rows of a YUV420 buffer are the luma plane; slicing is a view, not a copy
+    return frame, yuv[:HEIGHT, :WIDTH]
+
+def build_zone_overlay():
+    """Renders the zone lines once. Returns the BGR layer and a mask of the drawn pixels."""
+    layer = np.zeros((HEIGHT, WIDTH, 3), np.uint8)
     center = (WIDTH // 2, HEIGHT // 2)
     angle_step = 360 // 6
     for i in range(6):
@@ -92,263 +172,620 @@ def draw_zones(frame):
         pt1 = center
         pt2 = (int(center[0] + HEX_RADIUS * np.cos(angle1)), int(center[1] + HEX_RADIUS * np.sin(angle1)))
         pt3 = (int(center[0] + HEX_RADIUS * np.cos(angle2)), int(center[1] + HEX_RADIUS * np.sin(angle2)))
-        cv2.drawContours(frame, [np.array([pt1, pt2, pt3])], 0, (0, 255, 0), 1)
-    cv2.circle(frame, center, CENTER_RADIUS, (255, 0, 0), 1)
-    cv2.rectangle(frame, (0, 0), (NO_TRACKING_MARGIN, HEIGHT), (0, 0, 255), 2)
-    cv2.rectangle(frame, (WIDTH - NO_TRACKING_MARGIN, 0), (WIDTH, HEIGHT), (0, 0, 255), 2)
-
-def determine_piezone(cx, cy):
-    dx = cx - WIDTH // 2
-    dy = cy - HEIGHT // 2
-    angle = (np.arctan2(dy, dx) * 180 / np.pi) % 360
-    return int(angle // 60) + 1
-
-def in_center(cx, cy):
-    dx = cx - WIDTH // 2
-    dy = cy - HEIGHT // 2
-    return dx * dx + dy * dy <= CENTER_RADIUS * CENTER_RADIUS
+        cv2.drawContours(layer, [np.array([pt1, pt2, pt3])], 0, (0, 255, 0), 1)
+    cv2.circle(layer, center, CENTER_RADIUS, (255, 0, 0), 1)
+    cv2.rectangle(layer, (0, 0), (NO_TRACKING_MARGIN, HEIGHT), (0, 0, 255), 2)
+    cv2.rectangle(layer, (WIDTH - NO_TRACKING_MARGIN, 0), (WIDTH, HEIGHT), (0, 0, 255), 2)
+    return layer, layer.any(axis=2)[..., None]
+
+ZONE_LAYER, ZONE_MASK = build_zone_overlay()
+
+def draw_zones(frame):
+    """Composites the cached zone overlay onto frame. Only use on display/annotated copies."""
+    np.copyto(frame, ZONE_LAYER, where=ZONE_MASK)
 
 def create_tracker():
-    try:
-        return cv2.TrackerKCF_create()
-    except AttributeError:
-        return cv2.legacy.TrackerKCF_create()
+    """The tracker kept for a whole session; init() starts a fresh engine on every re-detection."""
+    if ADAPTIVE_TRACKER:
+        return AdaptiveTracker(TRACKER_LADDER, TRACKER_ENGINE, TRACK_BUDGET_MS)
+    return AdaptiveTracker([TRACKER_ENGINE], TRACKER_ENGINE, TRACK_BUDGET_MS)
 
 def generate_filename(base_time, sample_number, session_number, suffix):
     timestamp = base_time.strftime("%Y%m%d_%H%M%S")
     return f"{timestamp}_Sample{sample_number}_Session{session_number}_{suffix}"
 
-def find_moving_object_bbox(current_frame, previous_frame):
-    gray_current = cv2.cvtColor(current_frame, cv2.COLOR_BGR2GRAY)
-    gray_previous = cv2.cvtColor(previous_frame, cv2.COLOR_BGR2GRAY)
-    frame_diff = cv2.absdiff(gray_previous, gray_current)
-    blurred = cv2.GaussianBlur(frame_diff, (5, 5), 0)
-    _, thresh = cv2.threshold(blurred, 25, 255, cv2.THRESH_BINARY)
+def create_hexagon_mask():
+    """Arena hexagon minus the no-tracking margin, cropped to its bounding box (the
+    detection ROI) and scaled down to DETECT_LEVEL. Returns the mask and the ROI."""
+    mask = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+    center = (WIDTH // 2, HEIGHT // 2)
+    angle = np.pi / 3
+    points = [
+        (int(center[0] + HEX_RADIUS * np.cos(i * angle)),
+         int(center[1] + HEX_RADIUS * np.sin(i * angle)))
+        for i in range(6)
+    ]
+    cv2.fillConvexPoly(mask, np.array(points, np.int32), 255)
+    mask[ARENA.labels == 255] = 0
+    x, y, w, h = cv2.boundingRect(mask)
+    size = (w >> DETECT_LEVEL, h >> DETECT_LEVEL)
+    return cv2.resize(mask[y:y + h, x:x + w], size, interpolation=cv2.INTER_NEAREST), (x, y, w, h)
+
+DETECT_MASK, DETECT_ROI = create_hexagon_mask()
+DETECT_SCALE = 1 << DETECT_LEVEL
+# Below full resolution the leading and trailing edges of a moving animal come out
+# as separate, smaller blobs; dilating the mask by DETECT_SCALE - 1 pixels
+# keeps them one blob that passes the MIN_AREA test
+DETECT_DILATE = DETECT_SCALE - 1
+DETECT_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * DETECT_DILATE + 1,) * 2) if DETECT_DILATE else None
+
+def detection_input(gray):
+    """Crops a grayscale frame to the arena ROI and scales it down to DETECT_LEVEL."""
+    x, y, w, h = DETECT_ROI
+    roi = gray[y:y + h, x:x + w]
+    if DETECT_LEVEL == 0:
+        return roi
+    return cv2.resize(roi, (DETECT_MASK.shape[1], DETECT_MASK.shape[0]), interpolation=cv2.INTER_AREA)
+
+def motion_mask(detector, small_current, small_previous=None, window=None):
+    """The detector's motion mask for a detection_input image, limited to the arena.
+    window (x0, y0, x1, y1 in detection_input pixels) restricts it to a search window."""
+    arena_mask = DETECT_MASK
+    if window is not None:
+        x0, y0, x1, y1 = window
+        small_current = small_current[y0:y1, x0:x1]
+        if small_previous is not None:
+            small_previous = small_previous[y0:y1, x0:x1]
+        arena_mask = arena_mask[y0:y1, x0:x1]
+    return cv2.bitwise_and(detector.apply(small_current, small_previous), arena_mask)
+
+def search_window(center, half_size):
+    """Square of half_size pixels around a full-frame position, in detection_input
+    pixels (x0, y0, x1, y1), or None if it doesn't overlap the arena ROI."""
+    roi_x, roi_y = DETECT_ROI[0], DETECT_ROI[1]
+    mask_h, mask_w = DETECT_MASK.shape
+    x0 = max(int((center[0] - half_size - roi_x) / DETECT_SCALE), 0)
+    y0 = max(int((center[1] - half_size - roi_y) / DETECT_SCALE), 0)
+    x1 = min(int((center[0] + half_size - roi_x) / DETECT_SCALE), mask_w)
+    y1 = min(int((center[1] + half_size - roi_y) / DETECT_SCALE), mask_h)
+    if x1 - x0 < 8 or y1 - y0 < 8:
+        return None
+    return (x0, y0, x1, y1)
+
+def bbox_from_motion(thresh, offset=(0, 0)):
+    """Bounding box (full-frame pixels) of the largest moving blob in a motion mask, or None.
+    offset is where thresh starts within the detection_input image."""
+    if DETECT_KERNEL is not None:
+        thresh = cv2.dilate(thresh, DETECT_KERNEL)
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    moving_contours = [cnt for cnt in contours if cv2.contourArea(cnt) > MIN_AREA]
+    min_area = MIN_AREA / (DETECT_SCALE * DETECT_SCALE)
+    moving_contours = [cnt for cnt in contours if cv2.contourArea(cnt) > min_area]
     if not moving_contours:
         return None
     moving_object = max(moving_contours, key=cv2.contourArea)
     moments = cv2.moments(moving_object)
     if moments["m00"] == 0:
         return None
-    cx = int(moments["m10"] / moments["m00"])
-    cy = int(moments["m01"] / moments["m00"])
-    if cx < NO_TRACKING_MARGIN or cx > WIDTH - NO_TRACKING_MARGIN:
+    roi_x = DETECT_ROI[0] + offset[0] * DETECT_SCALE
+    roi_y = DETECT_ROI[1] + offset[1] * DETECT_SCALE
+    cx = roi_x + int(moments["m10"] / moments["m00"] * DETECT_SCALE)
+    cy = roi_y + int(moments["m01"] / moments["m00"] * DETECT_SCALE)
+    if ARENA.in_margin(cx, cy):
         return None
     x, y, w, h = cv2.boundingRect(moving_object)
-    return (x, y, w, h)
-
-def main():
-    base_time = datetime.datetime.now()
-    sample_number = input("Enter sample number: ")
-    session_number = 1
-
-    picam2 = initialize_camera()
-    print("Press spacebar to start tracking...")
+    # Undo the dilation's growth of the box
+    x, y = x + DETECT_DILATE, y + DETECT_DILATE
+    w, h = max(w - 2 * DETECT_DILATE, 1), max(h - 2 * DETECT_DILATE, 1)
+    return (roi_x + x * DETECT_SCALE, roi_y + y * DETECT_SCALE, w * DETECT_SCALE, h * DETECT_SCALE)
+
+class TrackingState:
+    """Tracker state carried from one analysed frame to the next."""
+
+    def __init__(self):
+        self.tracker = None
+        self.tracking = False
+        self.last_position = None
+        self.stationary_start = None
+        self.previous_gray = None
+        self.previous_small = None   # detection_input of the previous frame, if it was computed
+        self.cameratriggered = 0
+        self.detector = create_detector(MOTION_ENGINE)
+        self.engine = create_tracker()
+        self.kalman = CentroidKalman()
+
+def no_lap(stage):
+    pass
+
+def track_frame(state, frame, gray=None, lap=no_lap):
+    """Runs detection/tracking on one frame and drives the arm cameras.
+    gray is the frame's grayscale version if the caller already has it.
+    lap(stage) is called as each stage finishes (benchmark.py times them).
+    Returns (x, y, w, h, cx, cy, zone, center), or None when tracking is lost."""
+    if gray is None:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if state.previous_gray is None:
+        state.previous_gray = gray
+    lap("gray")
+
+    kalman = state.kalman
+    predicted = kalman.predict()
+    small = None
+    detecting = state.tracker is None or not state.tracking
+    window = None
+    if detecting and predicted is not None:
+        window = search_window(predicted, SEARCH_HALF_SIZE + SEARCH_GROWTH * kalman.coasting)
+    lap("predict")
+
+    if state.detector.continuous:
+        # Background models learn from every frame, even while the tracker has the animal
+        small = detection_input(gray)
+        lap("roi_downscale")
+        mask = motion_mask(state.detector, small)
+        lap("motion_mask")
+        bbox = None
+        if detecting and window:
+            x0, y0, x1, y1 = window
+            bbox = bbox_from_motion(mask[y0:y1, x0:x1], (x0, y0))
+        elif detecting:
+            bbox = bbox_from_motion(mask)
+    elif detecting:
+        small = detection_input(gray)
+        previous_small = state.previous_small
+        if previous_small is None:
+            previous_small = detection_input(state.previous_gray)
+        lap("roi_downscale")
+        mask = motion_mask(state.detector, small, previous_small, window)
+        lap("motion_mask")
+        bbox = bbox_from_motion(mask, window[:2] if window else (0, 0))
+    if detecting:
+        lap("find_contours")
+        if bbox:
+            state.tracker = state.engine
+            state.tracker.init(frame, bbox)
+            state.tracking = True
+            state.stationary_start = time.time()
+
+    if state.tracker is not None:
+        success, bbox = state.tracker.update(frame)
+        lap("tracker_update")
+    else:
+        success = False
+
+    result = None
+    if success:
+        x, y, w, h = map(int, bbox)
+        cx, cy = x + w // 2, y + h // 2
+        zone, center = ARENA.classify(cx, cy)
+        lap("zone")
+        if VERBOSE:
+            print(f"Object in piezone {zone}" + (" and centerzone" if center else ""))
+        state.cameratriggered = CAMERAS.set_zone(zone, center)
+        lap("gpio")
+
+        if state.last_position and (cx, cy) == state.last_position:
+            if time.time() - state.stationary_start > STATIONARY_THRESHOLD:
+                state.tracking = False
+                state.tracker = None
+                print("Object stationary too long. Reinitializing tracker.")
+        else:
+            state.stationary_start = time.time()
+        state.last_position = (cx, cy)
+        result = (x, y, w, h, cx, cy, zone, center)
+        kalman.correct(cx, cy, (w, h))
+    elif predicted is not None and kalman.coasting < MAX_COAST_FRAMES:
+        # Short dropout: keep the predicted zone instead of logging zone 0
+        state.tracking = False
+        state.tracker = None
+        kalman.coasting += 1
+        cx, cy = int(predicted[0]), int(predicted[1])
+        w, h = kalman.size
+        zone, center = ARENA.classify(cx, cy)
+        lap("zone")
+        state.cameratriggered = CAMERAS.set_zone(zone, center)
+        lap("gpio")
+        if VERBOSE:
+            print(f"Tracking lost, coasting in piezone {zone} ({kalman.coasting}/{MAX_COAST_FRAMES})")
+        result = (cx - w // 2, cy - h // 2, w, h, cx, cy, zone, center)
+    else:
+        state.tracking = False
+        state.tracker = None
+        kalman.reset()
+        if VERBOSE:
+            print("Tracking lost. Reinitializing...")
+
+    # Only the grayscale frame is kept, so each frame is converted at most once
+    state.previous_gray = gray
+    state.previous_small = small
+    lap("correct")
+    return result
+
+def annotate_frame(frame, result):
+    if result is None:
+        return
+    x, y, w, h, cx, cy, zone, center = result
+    cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
+    cv2.circle(frame, (cx, cy), 5, (0, 0, 255), -1)
+    cv2.putText(frame, f"Zone {zone}" + (" + Center" if center else ""), (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+
+def log_row(frame_count, timestamp, result, fps, cameratriggered):
+    """timestamp is the (time.time_ns(), time.monotonic_ns()) pair taken at capture."""
+    if result is None:
+        zone, center = 0, False
+    else:
+        zone, center = result[6], result[7]
+    return (frame_count, timestamp[0], timestamp[1], zone, center, fps, cameratriggered)
+
+class SessionRecorder:
+    """Video file and CSV log for one tracking session."""
+
+    def __init__(self, base_time, sample_number, session_number, picam2=None):
+        # picam2 is given when its hardware encoder should record the raw stream
+        self.video_writer = None
+        self.annotated_writer = None
+        self.picam2 = None
+        if RECORD_STREAM in ("raw", "both") and picam2 is not None:
+            video_filename = generate_filename(base_time, sample_number, session_number, "video.h264")
+            pts_filename = generate_filename(base_time, sample_number, session_number, "pts.txt")
+            self.picam2 = picam2
+            self.picam2.start_encoder(H264Encoder(bitrate=RECORD_BITRATE), video_filename, pts=pts_filename)
+            print(f"Started new video file: {video_filename}")
+        elif RECORD_STREAM in ("raw", "both"):
+            video_filename = generate_filename(base_time, sample_number, session_number, "video.mp4")
+            self.video_writer = cv2.VideoWriter(video_filename, cv2.VideoWriter_fourcc(*'mp4v'), FPS, (WIDTH, HEIGHT))
+            print(f"Started new video file: {video_filename}")
+        if RECORD_STREAM in ("annotated", "both"):
+            annotated_filename = generate_filename(base_time, sample_number, session_number, "annotated.mp4")
+            self.annotated_writer = cv2.VideoWriter(annotated_filename, cv2.VideoWriter_fourcc(*'mp4v'), FPS, (WIDTH, HEIGHT))
+            print(f"Started new video file: {annotated_filename}")
+        log_filename = generate_filename(base_time, sample_number, session_number, "log")
+        self.log = SessionLog(log_filename, export_csv=EXPORT_CSV)
+        print(f"Started new log file: {log_filename}.npy")
+
+    def write_frame(self, frame):
+        if self.video_writer:
+            self.video_writer.write(frame)
+
+    def write_annotated(self, frame):
+        if self.annotated_writer:
+            self.annotated_writer.write(frame)
+
+    def write_row(self, row):
+        self.log.append(*row)
+
+    def close(self):
+        if self.picam2:
+            self.picam2.stop_encoder()
+        if self.video_writer:
+            self.video_writer.release()
+        if self.annotated_writer:
+            self.annotated_writer.release()
+        print("Video file saved.")
+        self.log.close()
+        print("Log file saved.")
+
+def encoder_camera(source):
+    """The camera that records the raw stream itself, or None when raw frames go through VideoWriter."""
+    if HARDWARE_ENCODE:
+        return source.picam2
+    return None
+
+def wait_for_start(source, commands):
+    """Shows the camera until a start command (SPACE in the preview). Returns False on quit."""
+    print("Press spacebar (or send 'start') to start tracking...")
     while True:
-        frame = picam2.capture_array()
-        cv2.putText(frame, "Press SPACE to start", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-        cv2.imshow("Camera Feed", frame)
-        if cv2.waitKey(1) & 0xFF == ord(' '):
-            break
-
-    previous_frame = picam2.capture_array()
-    tracker = None
-    tracking = False
+        frame, _ = source.read()
+        if frame is None:
+            return False
+        if commands.preview_due():
+            cv2.putText(frame, "Press SPACE to start", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+        else:
+            frame = None
+        command = commands.poll(frame)
+        if command == "start":
+            return True
+        if command == "quit":
+            return False
+
+def run_serial(source, commands, base_time, sample_number):
+    """Original single-loop mode: every stage runs back to back on each frame."""
+    session_number = 1
+    state = TrackingState()
+    picam2 = encoder_camera(source)
+    recorder = SessionRecorder(base_time, sample_number, session_number, picam2)
     paused = False
-    last_position = None
-    stationary_start = None
-
-    video_filename = generate_filename(base_time, sample_number, session_number, "video.mp4")
-    log_filename = generate_filename(base_time, sample_number, session_number, "log.csv")
-    video_writer = cv2.VideoWriter(video_filename, cv2.VideoWriter_fourcc(*'mp4v'), FPS, (WIDTH, HEIGHT))
-    log_file = open(log_filename, mode='w', newline='')
-    log_writer = csv.writer(log_file)
-    log_writer.writerow(["Frame", "Timestamp", "Piezone", "InCenter", "FPS", "Camera"])
     start_led_thread()
 
     frame_count = 0
     prev_time = time.time()
     fps = 0.0
-    cameratriggered = 0
 
     while True:
-        frame = picam2.capture_array()
-        draw_zones(frame)
-        timestamp = datetime.datetime.now()
-        frame_count += 1
+        frame, gray = source.read()
+        if frame is None:
+            print("End of video.")
+            break
+        timestamp = (time.time_ns(), time.monotonic_ns())
         current_time = time.time()
         dt = current_time - prev_time
         prev_time = current_time
         fps = 0.9 * fps + 0.1 * (1.0 / dt)
 
+        result = None
         if not paused:
-            if tracker is None or not tracking:
-                bbox = find_moving_object_bbox(frame, previous_frame)
-                if bbox:
-                    tracker = create_tracker()
-                    tracker.init(frame, bbox)
-                    tracking = True
-                    stationary_start = time.time()
-
-            if tracker is not None:
-                success, bbox = tracker.update(frame)
-            else:
-                success = False
-
-            if success:
-                x, y, w, h = map(int, bbox)
-                cx, cy = x + w // 2, y + h // 2
-                zone = determine_piezone(cx, cy)
-                center = in_center(cx, cy)
-                print(f"Object in piezone {zone}" + (" and centerzone" if center else ""))
-                if center:
-                    GPIO.output(cam1,GPIO.LOW)
-                    GPIO.output(cam2,GPIO.LOW)
-                    GPIO.output(cam3,GPIO.LOW)
-                    GPIO.output(cam4,GPIO.LOW)
-                    GPIO.output(cam5,GPIO.LOW)
-                    GPIO.output(cam6,GPIO.LOW)
-                    cameratriggered = 0
-                    print('no camera on')
-                else:
-                    if zone == 1:
-                        GPIO.output(cam1, GPIO.LOW) # normally high in 6 arm box
-                        GPIO.output(cam2, GPIO.LOW)
-                        GPIO.output(cam3, GPIO.LOW)
-                        GPIO.output(cam4, GPIO.LOW)
-                        GPIO.output(cam5, GPIO.LOW)
-                        GPIO.output(cam6, GPIO.LOW)
-                        cameratriggered = 1
-                        print('GPIO ', cam1, ' triggered')
-                    if zone == 2:
-                        GPIO.output(cam1, GPIO.LOW)
-                        GPIO.output(cam2, GPIO.HIGH)
-                        GPIO.output(cam3, GPIO.LOW)
-                        GPIO.output(cam4, GPIO.LOW)
-                        GPIO.output(cam5, GPIO.LOW)
-                        GPIO.output(cam6, GPIO.LOW)
-                        cameratriggered = 2
-                        print('GPIO ', cam2, ' triggered')
-                    if zone == 3:
-                        GPIO.output(cam1, GPIO.LOW)
-                        GPIO.output(cam2, GPIO.LOW)
-                        GPIO.output(cam3, GPIO.HIGH)
-                        GPIO.output(cam4, GPIO.LOW)
-                        GPIO.output(cam5, GPIO.LOW)
-                        GPIO.output(cam6, GPIO.LOW)
-                        cameratriggered = 3
-                        print('GPIO ', cam3, ' triggered')
-                    if zone == 4:
-                        GPIO.output(cam1, GPIO.LOW)
-                        GPIO.output(cam2, GPIO.LOW)
-                        GPIO.output(cam3, GPIO.LOW)
-                        GPIO.output(cam4, GPIO.HIGH)
-                        GPIO.output(cam5, GPIO.LOW)
-                        GPIO.output(cam6, GPIO.LOW)
-                        cameratriggered = 4
-                        print('GPIO ', cam4, ' triggered')
-                    if zone == 5:
-                        GPIO.output(cam1, GPIO.HIGH) #for 2 arms...normally low for 6 arm
-                        GPIO.output(cam2, GPIO.LOW)
-                        GPIO.output(cam3, GPIO.LOW)
-                        GPIO.output(cam4, GPIO.LOW)
-                        GPIO.output(cam5, GPIO.HIGH)
-                        GPIO.output(cam6, GPIO.LOW)
-                        cameratriggered = 5
-                        print('GPIO ', cam5, ' triggered')
-                    if zone == 6:
-                        GPIO.output(cam1, GPIO.LOW)
-                        GPIO.output(cam2, GPIO.LOW)
-                        GPIO.output(cam3, GPIO.LOW)
-                        GPIO.output(cam4, GPIO.LOW)
-                        GPIO.output(cam5, GPIO.LOW)
-                        GPIO.output(cam6, GPIO.HIGH)
-                        cameratriggered = 6
-                        print('GPIO ', cam6, ' triggered')
-
-
-                cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
-                cv2.circle(frame, (cx, cy), 5, (0, 0, 255), -1)
-                cv2.putText(frame, f"Zone {zone}" + (" + Center" if center else ""), (10, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
-
-                if last_position and (cx, cy) == last_position:
-                    if time.time() - stationary_start > STATIONARY_THRESHOLD:
-                        tracking = False
-                        tracker = None
-                        print("Object stationary too long. Reinitializing tracker.")
-                else:
-                    stationary_start = time.time()
-                last_position = (cx, cy)
-
-                log_writer.writerow([frame_count, timestamp.strftime("%H:%M:%S.%f"), zone, center, round(fps, 2), cameratriggered])
-            else:
-                tracking = False
-                tracker = None
-                print("Tracking lost. Reinitializing...")
-                log_writer.writerow([frame_count, timestamp.strftime("%H:%M:%S.%f"), 0, False, round(fps, 2), cameratriggered])
-
-            if video_writer:
-                video_writer.write(frame)
-
-        cv2.putText(frame, f"FPS: {fps:.2f}", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
-        cv2.imshow("Tracking", frame)
-        key = cv2.waitKey(1) & 0xFF
-
-        if key == ord('q'):
+            # Frame n of a session's log is frame n - 1 of its video
+            frame_count += 1
+            result = track_frame(state, frame, gray)
+            recorder.write_row(log_row(frame_count, timestamp, result, fps, state.cameratriggered))
+            recorder.write_frame(frame)
+
+        # Overlays only ever go on a copy, the tracker and raw video see clean frames
+        display = None
+        if commands.preview_due() or RECORD_STREAM in ("annotated", "both"):
+            display = frame.copy()
+            draw_zones(display)
+            annotate_frame(display, result)
+            cv2.putText(display, f"FPS: {fps:.2f}", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
+            if not paused:
+                recorder.write_annotated(display)
+        command = commands.poll(display)
+
+        if command == "quit":
             break
 
-        elif key == ord('m'):
+        elif command == "pause" and not paused:
             paused = True
             print("Paused tracking and recording.")
-
-            # Stop and save current video
-            if video_writer:
-                video_writer.release()
-                video_writer = None
-                print("Video file saved.")
-
-            # Close current log file
-            if log_file:
-                log_file.close()
-                log_file = None
-                print("Log file saved.")
-
+            recorder.close()
+            recorder = None
             stop_led_thread()
 
-        elif key == ord('c') and paused:
+        elif command == "resume" and paused:
             paused = False
             session_number += 1
-            tracking = False
-            tracker = None
+            frame_count = 0
+            print(state.detector.stats())
+            state = TrackingState()
             print("Resumed tracking and recording.")
+            recorder = SessionRecorder(base_time, sample_number, session_number, picam2)
+            start_led_thread()
 
-            # Start a new video file
-            video_filename = generate_filename(base_time, sample_number, session_number, "video.mp4")
-            video_writer = cv2.VideoWriter(video_filename, cv2.VideoWriter_fourcc(*'mp4v'), FPS, (WIDTH, HEIGHT))
-            print(f"Started new video file: {video_filename}")
+    print(state.detector.stats())
+    if recorder:
+        recorder.close()
 
-            # Start a new log file
-            log_filename = generate_filename(base_time, sample_number, session_number, "log.csv")
-            log_file = open(log_filename, mode='w', newline='')
-            log_writer = csv.writer(log_file)
-            log_writer.writerow(["Frame", "Timestamp", "Piezone", "InCenter", "FPS", "Camera"])
-            print(f"Started new log file: {log_filename}")
+class PipelineControl:
+    """Flags shared between the pipeline threads."""
 
+    def __init__(self, queues=()):
+        self.stop = threading.Event()
+        self.paused = False
+        self.session_number = 1
+        self.queues = list(queues)
+        self.errors = []
+
+def run_stage(control, target, *args):
+    """Thread target for a pipeline stage. If the stage raises, the whole pipeline
+    is stopped (every queue closed so no stage stays blocked on it) and the
+    exception is kept in control.errors for run_pipelined to re-raise."""
+    try:
+        target(*args)
+    except BaseException as e:
+        print(f"{target.__name__} failed: {e!r}")
+        control.errors.append(e)
+        control.stop.set()
+        for q in control.queues:
+            q.close()
+
+def capture_loop(source, control, analysis_queue, record_queue):
+    """Capture stage: grabs frames as fast as the camera delivers them."""
+    raw_frames = RECORD_STREAM in ("raw", "both") and encoder_camera(source) is None
+    session_number = control.session_number
+    frame_count = 0
+    while not control.stop.is_set():
+        frame, gray = source.read()
+        if frame is None:
+            print("End of video.")
+            control.stop.set()
+            break
+        timestamp = (time.time_ns(), time.monotonic_ns())
+        if control.paused:
+            continue
+        # Counted per session and before the analysis queue can drop anything,
+        # so frame n of a session's log is frame n - 1 of its video
+        if control.session_number != session_number:
+            session_number = control.session_number
+            frame_count = 0
+        frame_count += 1
+        analysis_queue.put((control.session_number, frame_count, timestamp, frame, gray))
+        if raw_frames:
+            record_queue.put(("frame", frame))
+
+def analysis_loop(control, commands, analysis_queue, record_queue, display_queue):
+    """Analysis stage: tracks the newest frame, drives GPIO and queues the log row."""
+    state = TrackingState()
+    session_number = control.session_number
+    prev_time = time.time()
+    fps = 0.0
+
+    while True:
+        item = analysis_queue.get()
+        if item is None:
+            break
+        frame_session, frame_count, timestamp, frame, gray = item
+        if frame_session != session_number:
+            session_number = frame_session
+            print(state.detector.stats())
+            state = TrackingState()
+
+        current_time = time.time()
+        dt = current_time - prev_time
+        prev_time = current_time
+        fps = 0.9 * fps + 0.1 * (1.0 / dt)
+
+        result = track_frame(state, frame, gray)
+        record_queue.put(("row", log_row(frame_count, timestamp, result, fps, state.cameratriggered)))
+
+        record_annotated = RECORD_STREAM in ("annotated", "both")
+        show = commands.preview_due()
+        if not (show or record_annotated):
+            continue
+        display = frame.copy()
+        draw_zones(display)
+        annotate_frame(display, result)
+        cv2.putText(display, f"FPS: {fps:.2f}", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
+        if record_annotated:
+            # Only analysed frames end up in the annotated video
+            record_queue.put(("annotated", display))
+        if show:
+            display_queue.put(display)
+
+    print(state.detector.stats())
+
+def record_loop(record_queue, picam2, base_time, sample_number):
+    """Recording stage: writes every captured frame and log row, opens/closes session files."""
+    recorder = SessionRecorder(base_time, sample_number, 1, picam2)
+    try:
+        while True:
+            item = record_queue.get()
+            if item is None:
+                break
+            kind, payload = item
+            if kind == "frame":
+                if recorder:
+                    recorder.write_frame(payload)
+            elif kind == "annotated":
+                if recorder:
+                    recorder.write_annotated(payload)
+            elif kind == "row":
+                if recorder:
+                    recorder.write_row(payload)
+            elif kind == "pause":
+                if recorder:
+                    recorder.close()
+                    recorder = None
+            elif kind == "resume":
+                recorder = SessionRecorder(base_time, sample_number, payload, picam2)
+    finally:
+        # Also on errors, so the session log still gets its .npy/CSV
+        if recorder:
+            recorder.close()
+
+def run_pipelined(source, commands, base_time, sample_number):
+    """Capture -> analysis -> recording in three threads joined by bounded queues.
+    Analysis always works on the newest frame; recording never drops a frame.
+    If a stage fails, the others are stopped and its exception is re-raised here."""
+    # Max-speed replay analyses every frame; live sources drop stale ones
+    analysis_queue = FrameQueue(ANALYSIS_QUEUE_SIZE, LATEST if source.live else LOSSLESS, "analysis")
+    record_queue = FrameQueue(RECORD_QUEUE_SIZE, LOSSLESS, "record")
+    display_queue = FrameQueue(DISPLAY_QUEUE_SIZE, LATEST, "display")
+    control = PipelineControl((analysis_queue, record_queue, display_queue))
+
+    picam2 = encoder_camera(source)
+    capture_thread = threading.Thread(target=run_stage, args=(
+        control, capture_loop, source, control, analysis_queue, record_queue))
+    analysis_thread = threading.Thread(target=run_stage, args=(
+        control, analysis_loop, control, commands, analysis_queue, record_queue, display_queue))
+    record_thread = threading.Thread(target=run_stage, args=(
+        control, record_loop, record_queue, picam2, base_time, sample_number))
+    record_thread.start()
+    analysis_thread.start()
+    capture_thread.start()
+    start_led_thread()
+
+    # cv2 windows have to be driven from the main thread
+    while not control.stop.is_set():
+        display = display_queue.get(timeout=1.0 / FPS)
+        command = commands.poll(display)
+
+        if command == "quit":
+            break
+
+        elif command == "pause" and not control.paused:
+            control.paused = True
+            record_queue.put(("pause", None))
+            print("Paused tracking and recording.")
+            stop_led_thread()
+
+        elif command == "resume" and control.paused:
+            control.session_number += 1
+            record_queue.put(("resume", control.session_number))
+            control.paused = False
+            print("Resumed tracking and recording.")
             start_led_thread()
 
-        previous_frame = frame.copy()
+    # Closed queues still hand out what they hold, but no put() can block on them
+    control.stop.set()
+    analysis_queue.close()
+    record_queue.close()
+    capture_thread.join()
+    analysis_thread.join()
+    record_thread.join()
+
+    print("Dropped frames per stage:")
+    print(analysis_queue.stats())
+    print(record_queue.stats())
+    print(display_queue.stats())
+    if control.errors:
+        raise control.errors[0]
+
+def open_source(args):
+    if args.source == "webcam":
+        return VideoCaptureSource(args.device, (WIDTH, HEIGHT))
+    if args.source == "replay":
+        return ReplaySource(args.replay, (WIDTH, HEIGHT), realtime=not args.max_speed, fps=FPS)
+    return PicameraSource(initialize_camera(), capture_frame)
 
-    if video_writer:
-        video_writer.release()
-    if log_file:
-        log_file.close()
-    stop_led_thread()
-    GPIO.cleanup()
-    cv2.destroyAllWindows()
-    picam2.stop()
+def main():
+    global MOTION_ENGINE, TRACKER_ENGINE
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', choices=["picamera", "webcam", "replay"], default="picamera",
+                        help='Where frames come from (default: the Pi camera)')
+    parser.add_argument('--device', type=int, default=0, help='cv2.VideoCapture index for --source webcam')
+    parser.add_argument('--replay', help='Recorded .mp4/.h264 session to replay for --source replay')
+    parser.add_argument('--max-speed', action='store_true', help='Replay as fast as possible instead of in real time')
+    parser.add_argument('--sample', help='Sample number (asked for if not given)')
+    parser.add_argument('--headless', action='store_true',
+                        help='No preview window; start/pause/resume/quit are read from stdin')
+    parser.add_argument('--socket', help='Also accept start/pause/resume/quit on this UNIX socket')
+    parser.add_argument('--preview-fps', type=float,
+                        help='Limit the preview to this many frames per second (shows a preview even when headless)')
+    parser.add_argument('--motion-engine', choices=list(DETECTORS), default=MOTION_ENGINE,
+                        help='Motion detector used to find the animal')
+    parser.add_argument('--tracker', choices=TRACKER_LADDER if ADAPTIVE_TRACKER else list(TRACKERS),
+                        default=TRACKER_ENGINE, help='Tracker engine to start with')
+    args = parser.parse_args()
+    if args.source == "replay" and not args.replay:
+        parser.error("--source replay needs --replay PATH")
+
+    MOTION_ENGINE = args.motion_engine
+    TRACKER_ENGINE = args.tracker
+
+    base_time = datetime.datetime.now()
+    sample_number = args.sample or input("Enter sample number: ")
+
+    preview_fps = args.preview_fps
+    if args.headless and preview_fps is None:
+        preview_fps = 0
+    commands = SessionControl(preview_fps, stdin=args.headless, socket_path=args.socket)
+
+    source = open_source(args)
+    started = args.source == "replay" or wait_for_start(source, commands)
+
+    try:
+        if started and PIPELINED:
+            run_pipelined(source, commands, base_time, sample_number)
+        elif started:
+            run_serial(source, commands, base_time, sample_number)
+    finally:
+        stop_led_thread()
+        CAMERAS.off()
+        print(f"Camera pin writes: {CAMERAS.writes}")
+        if GPIO:
+            GPIO.cleanup()
+        cv2.destroyAllWindows()
+        commands.close()
+        source.close()
 
 if __name__ == "__main__":
     main()
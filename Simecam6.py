@@ -2,7 +2,9 @@
 import RPi.GPIO as GPIO
 from picamera2 import Picamera2
 from picamera2.encoders import H264Encoder
+from picamera2.outputs import CircularOutput
 from datetime import datetime
+import threading
 import time
 import csv
 import os
@@ -18,6 +20,17 @@ on_time   = None
 
 lens_pos = 6
 
+# Pre-trigger recording: the encoder runs all the time into an in-memory ring
+# of the last PRE_ROLL_SECONDS of H.264. A rising edge writes that ring to the
+# new file and carries on live; after a falling edge POST_ROLL_SECONDS more are
+# kept. Costs roughly bitrate * PRE_ROLL_SECONDS of RAM (about 6 MB here).
+PRE_TRIGGER = True
+FRAMERATE = 30
+PRE_ROLL_SECONDS = 5
+POST_ROLL_SECONDS = 2
+post_roll_timer = None
+record_lock = threading.Lock()   # edge callback vs. post-roll timer
+
 # Prepare CSV log
 log_filename = f"log_{datetime.now():%Y-%m-%d_%H-%M-%S}.csv"
 file_exists = os.path.exists(log_filename)
@@ -47,7 +60,13 @@ camera.set_controls({
     "AfMode": 0,
     "LensPosition": lens_pos
 })
-encoder = H264Encoder(bitrate=10000000) #can try to up
+# repeat=True puts SPS/PPS in front of every keyframe so a file can start at
+# any keyframe in the ring; iperiod keeps one per second of pre-roll
+encoder = H264Encoder(bitrate=10000000, repeat=True, iperiod=FRAMERATE) #can try to up
+circular = None
+if PRE_TRIGGER:
+    circular = CircularOutput(buffersize=PRE_ROLL_SECONDS * FRAMERATE)
+    camera.start_recording(encoder, circular)
 
 def log_event(state: str, timestamp: datetime):
     """Append an ON/OFF event to the CSV log."""
@@ -60,8 +79,10 @@ def start_record(timestamp: datetime):
     on_time = timestamp
     GPIO.output(RECORD_LED_PIN, GPIO.HIGH)
     filename = f"video_{on_time:%Y-%m-%d_%H-%M-%S.%f}.h264"
+    # Frame timestamps for remuxdaemon, which turns the raw stream into MP4/MKV
+    pts_filename = filename[:-len(".h264")] + "_pts.txt"
     try:
-        camera.start_recording(encoder, output=filename)
+        camera.start_recording(encoder, output=filename, pts=pts_filename)
         log_event("ON", on_time)
         recording = True
         print(f"Recording started: {filename}")
@@ -80,9 +101,66 @@ def stop_record(timestamp: datetime):
     except Exception as e:
         print(f"Error stopping recording: {e}")
 
+def start_pretrigger_record(timestamp: datetime):
+    """Flush the ring buffer into a new file and keep writing live frames."""
+    global recording, on_time, post_roll_timer
+    if post_roll_timer:
+        # Back in the arm during post-roll: carry on with the same file
+        post_roll_timer.cancel()
+        post_roll_timer = None
+        log_event("ON", timestamp)
+        print("Recording continues (re-triggered during post-roll)")
+        return
+    on_time = timestamp
+    GPIO.output(RECORD_LED_PIN, GPIO.HIGH)
+    filename = f"video_{on_time:%Y-%m-%d_%H-%M-%S.%f}.h264"
+    try:
+        circular.fileoutput = filename
+        circular.ptsoutput = filename[:-len(".h264")] + "_pts.txt"
+        circular.start()
+        log_event("ON", on_time)
+        recording = True
+        print(f"Recording started: {filename} (with {PRE_ROLL_SECONDS} s pre-roll)")
+    except Exception as e:
+        print(f"Error starting recording: {e}")
+
+def finish_pretrigger_record():
+    global post_roll_timer
+    with record_lock:
+        # A re-trigger may have cancelled this timer after it had already fired
+        if post_roll_timer is not threading.current_thread():
+            return
+        post_roll_timer = None
+        close_pretrigger_file()
+
+def close_pretrigger_file():
+    global recording
+    try:
+        circular.stop()
+        GPIO.output(RECORD_LED_PIN, GPIO.LOW)
+        recording = False
+        print(f"Recording stopped at {datetime.now():%Y-%m-%d %H:%M:%S.%f}")
+    except Exception as e:
+        print(f"Error stopping recording: {e}")
+
+def stop_pretrigger_record(timestamp: datetime):
+    """Keep recording for the post-roll, then close the file."""
+    global post_roll_timer
+    log_event("OFF", timestamp)
+    post_roll_timer = threading.Timer(POST_ROLL_SECONDS, finish_pretrigger_record)
+    post_roll_timer.start()
+
 def handle_input_change(channel):
     """Unified callback for both rising and falling edges."""
     timestamp = datetime.now()
+    if PRE_TRIGGER:
+        with record_lock:
+            if GPIO.input(INPUT_PIN):  # HIGH = Rising edge
+                if not recording or post_roll_timer:
+                    start_pretrigger_record(timestamp)
+            elif recording and not post_roll_timer:  # LOW = Falling edge
+                stop_pretrigger_record(timestamp)
+        return
     if GPIO.input(INPUT_PIN):  # HIGH = Rising edge
         if not recording:
             start_record(timestamp)
@@ -102,6 +180,12 @@ except KeyboardInterrupt:
     print("\nInterrupted by user; exiting.")
 
 finally:
+    with record_lock:
+        if post_roll_timer:
+            post_roll_timer.cancel()
+            post_roll_timer = None
+        if PRE_TRIGGER and recording:
+            close_pretrigger_file()
     camera.stop_recording()
     camera.close()
     GPIO.cleanup()
@@ -0,0 +1,78 @@
+import cv2
+import numpy as np
+
+CENTER = 0
+NO_TRACKING = 255
+
+
+class ArenaMap:
+    """Zone lookup table for the maze, built once at startup.
+
+    labels[y, x] holds the zone of every pixel: 0 = centre, 1..N = arms,
+    255 = no-tracking margin. arms[y, x] holds the arm under every pixel
+    (including the centre), which is what the log's Piezone column records.
+    """
+
+    def __init__(self, width, height, arms, center_mask, margin_mask=None):
+        self.width = width
+        self.height = height
+        self.arms = arms
+        self.labels = arms.copy()
+        self.labels[center_mask] = CENTER
+        if margin_mask is not None:
+            self.labels[margin_mask] = NO_TRACKING
+
+    @classmethod
+    def hexagonal(cls, width, height, center_radius, margin=0):
+        """Six 60 degree wedges around the frame centre, a round centre zone and
+        no-tracking strips down the left and right edges (the Retrack layout).
+        Like determine_piezone, the wedges cover the whole frame."""
+        ys, xs = np.mgrid[0:height, 0:width]
+        dx = xs - width // 2
+        dy = ys - height // 2
+        angle = np.degrees(np.arctan2(dy, dx)) % 360
+        arms = np.minimum(angle // 60, 5).astype(np.uint8) + 1
+        center_mask = dx * dx + dy * dy <= center_radius * center_radius
+        margin_mask = (xs < margin) | (xs > width - margin)
+        return cls(width, height, arms, center_mask, margin_mask)
+
+    @classmethod
+    def from_polygons(cls, width, height, arm_polygons, center_polygon, margin_polygons=()):
+        """Arbitrary maze geometry. arm_polygons[i] is the pixel outline of arm i + 1;
+        pixels not covered by any arm or the centre are treated as no-tracking."""
+        arms = np.full((height, width), NO_TRACKING, np.uint8)
+        for i, polygon in enumerate(arm_polygons):
+            cv2.fillPoly(arms, [np.asarray(polygon, np.int32)], i + 1)
+        center_mask = np.zeros((height, width), np.uint8)
+        cv2.fillPoly(center_mask, [np.asarray(center_polygon, np.int32)], 1)
+        margin_mask = np.zeros((height, width), np.uint8)
+        for polygon in margin_polygons:
+            cv2.fillPoly(margin_mask, [np.asarray(polygon, np.int32)], 1)
+        center_mask = center_mask.astype(bool)
+        margin_mask = margin_mask.astype(bool) | ((arms == NO_TRACKING) & ~center_mask)
+        # Centre pixels outside every arm outline log Piezone 0, not NO_TRACKING
+        arms[center_mask & (arms == NO_TRACKING)] = CENTER
+        return cls(width, height, arms, center_mask, margin_mask)
+
+    def classify(self, cx, cy):
+        """Returns (arm, in_center) for one pixel position."""
+        x = min(max(int(cx), 0), self.width - 1)
+        y = min(max(int(cy), 0), self.height - 1)
+        return int(self.arms[y, x]), bool(self.labels[y, x] == CENTER)
+
+    def in_margin(self, cx, cy):
+        x = min(max(int(cx), 0), self.width - 1)
+        y = min(max(int(cy), 0), self.height - 1)
+        return bool(self.labels[y, x] == NO_TRACKING)
+
+    def classify_points(self, xs, ys):
+        """Vectorized classify for whole trajectories. Returns (arms, in_center) arrays."""
+        x = np.clip(np.asarray(xs).astype(np.intp), 0, self.width - 1)
+        y = np.clip(np.asarray(ys).astype(np.intp), 0, self.height - 1)
+        return self.arms[y, x], self.labels[y, x] == CENTER
+
+    def label_points(self, xs, ys):
+        """Vectorized lookup of the raw labels (0 = centre, arms, 255 = no-tracking)."""
+        x = np.clip(np.asarray(xs).astype(np.intp), 0, self.width - 1)
+        y = np.clip(np.asarray(ys).astype(np.intp), 0, self.height - 1)
+        return self.labels[y, x]
@@ -1,12 +1,13 @@
 import os
-import shutil
 import datetime
-import subprocess
+from backupmanifest import Manifest, collect_recordings
 
 # Configuration
 source_folder = "/home/lhm403/6armbox/"  # Replace with your actual source folder
 videos_root = "/home/lhm403/6armbox/videos"
 backup_target = "/media/networkshare/6armboxDATA/"
+manifest_path = os.path.join(source_folder, "backup_manifest.sqlite3")
+backup_workers = 4
 
 cameraname = input("Which camera is this? ").strip()
 
@@ -22,21 +23,17 @@ if not os.path.exists(target_folder):
 else:
     print(f"Folder already exists: {target_folder}")
 
-# Step 2: Move specified file types
-file_extensions = [".csv", ".jpg", ".h264", ".mp4"]
-for ext in file_extensions:
-    print('checking for ', ext, ' files')
-    files = [f for f in os.listdir(source_folder) if f.endswith(ext)]
-
-    for file in files:
-        src_path = os.path.join(source_folder, file)
-        dst_path = os.path.join(target_folder, file)
-        shutil.move(src_path, dst_path)
-        print(f"Moved: {file} to {target_folder}")
-
-# Step 3: Use rclone to copy /videos to /media/6armbox/
-try:
-    subprocess.run(["rclone", "copy", "-P",  videos_root, backup_target], check=True)
-    print("rclone copy completed successfully.")
-except subprocess.CalledProcessError as e:
-    print(f"rclone failed: {e}")
+# Step 2: Move finished recordings (raw .h264 streams are left to remuxdaemon
+# while it runs, see backupmanifest.collect_recordings)
+collect_recordings(source_folder, target_folder)
+
+# Step 3: Copy new or changed files under /videos to the backup target.
+# The manifest remembers what has been backed up, so only new data is read and
+# an interrupted backup picks up where it stopped.
+manifest = Manifest(manifest_path)
+copied, failed = manifest.backup(videos_root, backup_target, workers=backup_workers)
+manifest.close()
+if failed:
+    print(f"Backup incomplete: {copied} files copied, {failed} failed (re-run to retry).")
+else:
+    print(f"Backup completed successfully: {copied} files copied.")
@@ -0,0 +1,302 @@
+import os
+import time
+import shutil
+import hashlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import remuxdaemon
+
+CHUNK_SIZE = 1 << 20
+
+# Written at the top of the backup target: "<hash>  <relative path>" per file
+TARGET_MANIFEST = "backup_manifest.txt"
+
+# Moved from the camera folder into the day's folder before a backup. Raw .h264
+# streams come from remuxdaemon's raw/ and failed/ folders, or straight from the
+# camera folder on boxes where the daemon isn't running
+RECORDING_EXTENSIONS = (".csv", ".jpg", ".mp4", ".mkv")
+RAW_EXTENSIONS = (".h264", "_pts.txt")
+RAW_FOLDERS = ("raw", "failed")
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL
+)
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,      -- relative to the backed-up root
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT,                  -- blake2b of the content, set when copied
+    state TEXT NOT NULL,        -- 'pending', 'copied', or 'gone' (copied, since deleted locally)
+    backed_up_at REAL
+)
+"""
+
+
+def file_hash():
+    return hashlib.blake2b(digest_size=20)
+
+
+def walk_files(root):
+    """(relative path, os.stat_result) of every regular file below root, skipping dotfiles."""
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield os.path.relpath(entry.path, root), entry.stat(follow_symlinks=False)
+
+
+def list_files(folder, extensions, min_age=0):
+    """Names of the files directly in folder ending in one of extensions and
+    untouched for at least min_age seconds; empty if folder doesn't exist."""
+    if not os.path.isdir(folder):
+        return []
+    now = time.time()
+    with os.scandir(folder) as entries:
+        return sorted(entry.name for entry in entries if entry.is_file() and entry.name.endswith(extensions)
+                      and now - entry.stat().st_mtime >= min_age)
+
+
+def move_files(folder, names, destination):
+    if names:
+        os.makedirs(destination, exist_ok=True)
+    for name in names:
+        shutil.move(os.path.join(folder, name), os.path.join(destination, name))
+        print(f"Moved: {name} to {destination}")
+
+
+def collect_recordings(source_folder, target_folder):
+    """Moves finished recordings from a camera folder into target_folder and
+    warns about raw streams that have to wait for a later run."""
+    move_files(source_folder, list_files(source_folder, RECORDING_EXTENSIONS), target_folder)
+    for subfolder in RAW_FOLDERS:
+        folder = os.path.join(source_folder, subfolder)
+        move_files(folder, list_files(folder, RAW_EXTENSIONS), os.path.join(target_folder, subfolder))
+
+    streams = list_files(source_folder, (".h264",))
+    if remuxdaemon.daemon_running(source_folder):
+        left = streams
+        reason = "waiting for remuxdaemon"
+    else:
+        settled = list_files(source_folder, (".h264",), remuxdaemon.SETTLE_SECONDS)
+        companions = [remuxdaemon.pts_file(os.path.join(source_folder, name)) for name in settled]
+        move_files(source_folder, settled + [os.path.basename(p) for p in companions if p], target_folder)
+        left = [name for name in streams if name not in settled]
+        reason = "still being written"
+    if left:
+        print(f"Warning: {len(left)} raw .h264 streams in {source_folder} are {reason} and were not "
+              f"collected; run the backup again later: {', '.join(left)}")
+
+
+def hash_path(path):
+    digest = file_hash()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_with_hash(src_path, dst_path):
+    """Copies a file through a .part file, hashing it on the way, so the source
+    is read once. The copy only gets its final name once it is complete."""
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    part_path = dst_path + ".part"
+    digest = file_hash()
+    with open(src_path, "rb") as src, open(part_path, "wb") as dst:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            dst.write(chunk)
+        dst.flush()
+        os.fsync(dst.fileno())
+    shutil.copystat(src_path, part_path)
+    os.replace(part_path, dst_path)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """SQLite record of every file under a root: size, mtime, content hash and
+    whether the current version has been backed up.
+
+    scan() marks new or changed files 'pending' and forgets files that have
+    disappeared; backup() copies only the pending ones, a worker pool doing
+    the I/O while this thread records each finished file, so an interrupted
+    backup resumes where it stopped.
+    """
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        self.db.execute(SCHEMA)
+        self.db.commit()
+
+    def scan(self, root):
+        """Returns the number of files that are new or changed since the last scan.
+
+        Files no longer under root are dropped if they were never copied, and
+        marked 'gone' if they were (their backup and its hash are kept).
+        """
+        known = {path: (size, mtime_ns, state) for path, size, mtime_ns, state in
+                 self.db.execute("SELECT path, size, mtime_ns, state FROM files")}
+        changed = []
+        seen = set()
+        for path, stat in walk_files(root):
+            seen.add(path)
+            entry = known.get(path)
+            if entry is None or entry[2] == "gone" or entry[:2] != (stat.st_size, stat.st_mtime_ns):
+                changed.append((path, stat.st_size, stat.st_mtime_ns))
+        self.db.executemany(
+            "INSERT INTO files (path, size, mtime_ns, hash, state) VALUES (?, ?, ?, NULL, 'pending') "
+            "ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, "
+            "hash = NULL, state = 'pending', backed_up_at = NULL", changed)
+        vanished = [(path,) for path in known if path not in seen]
+        self.db.executemany("DELETE FROM files WHERE path = ? AND state = 'pending'", vanished)
+        self.db.executemany("UPDATE files SET state = 'gone' WHERE path = ? AND state = 'copied'", vanished)
+        self.db.commit()
+        return len(changed)
+
+    def pending(self):
+        return self.db.execute("SELECT path, size, mtime_ns FROM files WHERE state = 'pending'").fetchall()
+
+    def mark_copied(self, path, file_hash):
+        self.db.execute("UPDATE files SET hash = ?, state = 'copied', backed_up_at = ? WHERE path = ?",
+                        (file_hash, time.time(), path))
+        self.db.commit()
+
+    def backup(self, root, target, workers=4):
+        """Copies pending files from root to the same relative paths under target.
+        Returns (copied, failed)."""
+        self.scan(root)
+        pending = self.pending()
+        copied = failed = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(copy_with_hash, os.path.join(root, path), os.path.join(target, path)):
+                       (path, size, mtime_ns) for path, size, mtime_ns in pending}
+            for future in as_completed(futures):
+                path, size, mtime_ns = futures[future]
+                src_path = os.path.join(root, path)
+                try:
+                    digest = future.result()
+                except OSError as e:
+                    if not os.path.exists(src_path):
+                        # Deleted or moved since the scan; the next scan forgets it
+                        print(f"{path} disappeared before it was backed up")
+                        continue
+                    print(f"Backup of {path} failed: {e}")
+                    failed += 1
+                    continue
+                try:
+                    stat = os.stat(src_path)
+                except FileNotFoundError:
+                    print(f"{path} disappeared during backup")
+                    continue
+                if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                    # Changed while it was being copied: left pending for the next run
+                    print(f"{path} changed during backup, will be copied again")
+                    continue
+                self.mark_copied(path, digest)
+                copied += 1
+                print(f"Backed up: {path}")
+        self.write_target_manifest(target)
+        return copied, failed
+
+    def write_target_manifest(self, target):
+        """Writes the hashes of everything backed up next to the backup itself."""
+        manifest_path = os.path.join(target, TARGET_MANIFEST)
+        with open(manifest_path + ".part", "w") as f:
+            for path, digest in self.db.execute(
+                    "SELECT path, hash FROM files WHERE state IN ('copied', 'gone') ORDER BY path"):
+                f.write(f"{digest}  {path}\n")
+        os.replace(manifest_path + ".part", manifest_path)
+
+    def close(self):
+        self.db.close()
+
+
+def read_target_manifest(target):
+    """{relative path: hash} from the manifest at the top of a backup."""
+    expected = {}
+    with open(os.path.join(target, TARGET_MANIFEST)) as f:
+        for line in f:
+            digest, path = line.rstrip("\n").split("  ", 1)
+            expected[path] = digest
+    return expected
+
+
+class HashCache:
+    """Content hashes keyed by (path, size, mtime), so unchanged files are
+    never read twice. Hashing of the files that do need it is spread over a
+    thread pool (file reads and blake2b both release the GIL)."""
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        self.db.execute(CACHE_SCHEMA)
+        self.db.commit()
+        self.hashed = 0
+
+    def hashes(self, root, paths, workers=4, rehash=False):
+        """{path: hash} for the given relative paths under root; missing files are left out."""
+        cached = {path: (size, mtime_ns, digest) for path, size, mtime_ns, digest in
+                  self.db.execute("SELECT path, size, mtime_ns, hash FROM hashes")}
+        result = {}
+        todo = []
+        for path in paths:
+            try:
+                stat = os.stat(os.path.join(root, path))
+            except FileNotFoundError:
+                continue
+            entry = cached.get(path)
+            if not rehash and entry and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+                result[path] = entry[2]
+            else:
+                todo.append((path, stat.st_size, stat.st_mtime_ns))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(hash_path, os.path.join(root, path)): (path, size, mtime_ns)
+                       for path, size, mtime_ns in todo}
+            for future in as_completed(futures):
+                path, size, mtime_ns = futures[future]
+                try:
+                    digest = future.result()
+                except OSError as e:
+                    print(f"Could not read {path}: {e}")
+                    continue
+                result[path] = digest
+                self.hashed += 1
+                self.db.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)",
+                                (path, size, mtime_ns, digest))
+                self.db.commit()
+        return result
+
+    def close(self):
+        self.db.close()
+
+
+def verify_backup(target, cache_path, workers=4, rehash=False):
+    """Checks every file in the target's manifest against its content hash.
+    Returns (ok, missing, mismatched) with lists of relative paths for the latter two."""
+    expected = read_target_manifest(target)
+    cache = HashCache(cache_path)
+    actual = cache.hashes(target, expected, workers=workers, rehash=rehash)
+    print(f"Hashed {cache.hashed} files, {len(actual) - cache.hashed} unchanged since the last check")
+    cache.close()
+    missing = sorted(path for path in expected if path not in actual)
+    mismatched = sorted(path for path in actual if actual[path] != expected[path])
+    ok = len(expected) - len(missing) - len(mismatched)
+    return ok, missing, mismatched
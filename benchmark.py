@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# Per-stage latency benchmark for the Retrack15 tracking loop.
+#
+# Runs Retrack15.track_frame itself, timing each stage through its lap hook, on a
+# recorded session or a synthetic moving-blob video, and writes p50/p95/p99 latency and
+# throughput per stage to a JSON report so runs can be compared across commits
+# and Pi models:
+#
+#   python benchmark.py --video 20250101_120000_Sample3_Session1_video.mp4
+#   python benchmark.py --synthetic 2000 --output pi4.json
+
+import os
+import sys
+import json
+import time
+import datetime
+import platform
+import argparse
+import tempfile
+import subprocess
+import cv2
+import numpy as np
+
+import Retrack15 as rt
+from motiondetect import DETECTORS
+from framesource import FrameSource, ReplaySource
+from sessionlog import SessionLog
+
+STAGES = ["capture", "gray", "predict", "roi_downscale", "motion_mask", "find_contours", "tracker_update",
+          "zone", "gpio", "correct", "log", "video_write", "display"]
+
+
+class SyntheticSource(FrameSource):
+    """A dark blob running laps around the arena on a noisy background."""
+
+    def __init__(self, frames, size=(rt.WIDTH, rt.HEIGHT), seed=0):
+        self.frames = frames
+        self.width, self.height = size
+        self.count = 0
+        rng = np.random.default_rng(seed)
+        self.background = rng.integers(150, 180, (self.height, self.width, 3), dtype=np.uint8)
+
+    def read(self):
+        if self.count >= self.frames:
+            return None, None
+        angle = self.count * 2 * np.pi / 240
+        radius = 40 + 140 * (0.5 + 0.5 * np.sin(self.count * 2 * np.pi / 97))
+        cx = int(self.width // 2 + radius * np.cos(angle))
+        cy = int(self.height // 2 + radius * np.sin(angle))
+        frame = self.background.copy()
+        cv2.ellipse(frame, (cx, cy), (30, 18), np.degrees(angle), 0, 360, (40, 40, 40), -1)
+        self.count += 1
+        return frame, None
+
+
+class StageTimes:
+    """Collects per-stage durations in nanoseconds."""
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+        self.start = None
+
+    def begin(self):
+        self.start = time.perf_counter_ns()
+
+    def lap(self, stage):
+        now = time.perf_counter_ns()
+        self.samples[stage].append(now - self.start)
+        self.start = now
+
+    def summary(self):
+        stages = {}
+        for stage, values in self.samples.items():
+            if not values:
+                continue
+            ms = np.array(values) / 1e6
+            stages[stage] = {
+                "count": len(values),
+                "mean_ms": round(float(ms.mean()), 4),
+                "p50_ms": round(float(np.percentile(ms, 50)), 4),
+                "p95_ms": round(float(np.percentile(ms, 95)), 4),
+                "p99_ms": round(float(np.percentile(ms, 99)), 4),
+                "max_ms": round(float(ms.max()), 4),
+                "throughput_fps": round(len(values) / (ms.sum() / 1000), 2) if ms.sum() else None,
+            }
+        return stages
+
+
+def machine_info():
+    info = {
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+    }
+    try:
+        with open("/proc/device-tree/model") as f:
+            info["model"] = f.read().strip("\x00\n")
+    except OSError:
+        info["model"] = platform.node()
+    try:
+        info["commit"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                        text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        info["commit"] = None
+    return info
+
+
+def run(source, output_dir, display=False, motion_engine="diff", verbose=False):
+    """Runs source through Retrack15's track_frame, logging, recording and
+    display, and returns the report. Stages inside track_frame are timed
+    through its lap hook; stages it skips on a frame are not counted. The
+    per-frame prints are off unless verbose, so "zone" and "gpio" time the
+    classification and pin writes rather than stdout."""
+    times = StageTimes()
+    video_writer = cv2.VideoWriter(os.path.join(output_dir, "bench_video.mp4"),
+                                   cv2.VideoWriter_fourcc(*'mp4v'), rt.FPS, (rt.WIDTH, rt.HEIGHT))
+    log = SessionLog(os.path.join(output_dir, "bench_log"), export_csv=False)
+
+    rt.MOTION_ENGINE = motion_engine
+    rt.VERBOSE = verbose
+    rt.CAMERAS.verbose = verbose
+    state = rt.TrackingState()
+    frames = 0
+    tracked = 0
+    wall_start = time.perf_counter()
+
+    while True:
+        times.begin()
+        frame, gray = source.read()
+        if frame is None:
+            break
+        times.lap("capture")
+        frames += 1
+        timestamp = (time.time_ns(), time.monotonic_ns())
+
+        result = rt.track_frame(state, frame, gray, times.lap)
+        if result is not None:
+            tracked += 1
+
+        times.begin()
+        log.append(*rt.log_row(frames, timestamp, result, 0.0, state.cameratriggered))
+        times.lap("log")
+        video_writer.write(frame)
+        times.lap("video_write")
+
+        output = frame.copy()
+        rt.draw_zones(output)
+        rt.annotate_frame(output, result)
+        if display:
+            cv2.imshow("Benchmark", output)
+            cv2.waitKey(1)
+        times.lap("display")
+
+    wall_time = time.perf_counter() - wall_start
+    video_writer.release()
+    log.close()
+    source.close()
+    if display:
+        cv2.destroyAllWindows()
+
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "machine": machine_info(),
+        "frames": frames,
+        "motion_engine": state.detector.name,
+        "motion_engine_mean_ms": round(state.detector.mean_ms(), 4),
+        "tracker_engine": state.engine.name,
+        "tracker_switches": state.engine.switches,
+        "tracked_frames": tracked,
+        "camera_pin_writes": rt.CAMERAS.writes,
+        "wall_time_s": round(wall_time, 3),
+        "throughput_fps": round(frames / wall_time, 2) if wall_time else None,
+        "stages": times.summary(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency benchmark for the Retrack15 tracking loop")
+    parser.add_argument('--video', help='Recorded session to replay (at max speed)')
+    parser.add_argument('--synthetic', type=int, default=1000, help='Number of synthetic frames if no --video is given')
+    parser.add_argument('--output', default='bench_report.json', help='Where to write the JSON report')
+    parser.add_argument('--display', action='store_true', help='Include cv2.imshow in the display stage')
+    parser.add_argument('--motion-engine', choices=list(DETECTORS), default=rt.MOTION_ENGINE,
+                        help='Motion detector engine to benchmark')
+    parser.add_argument('--verbose', action='store_true', help="Keep Retrack15's per-frame prints in the timings")
+    args = parser.parse_args()
+
+    if args.video:
+        source = ReplaySource(args.video, (rt.WIDTH, rt.HEIGHT), realtime=False)
+        source_name = os.path.basename(args.video)
+    else:
+        source = SyntheticSource(args.synthetic)
+        source_name = f"synthetic:{args.synthetic}"
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        report = run(source, output_dir, args.display, args.motion_engine, args.verbose)
+    report["source"] = source_name
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{report['frames']} frames in {report['wall_time_s']} s ({report['throughput_fps']} FPS)")
+    print(f"{'stage':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<22}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+import time
+import collections
+
+# Zone -> arm camera bitmask (bit i drives pins[i], i.e. cam1 is bit 0).
+# Zone 0 is the centre zone. One table per box wiring.
+BOX_LAYOUTS = {
+    # One camera per arm
+    "6arm": {0: 0b000000, 1: 0b000001, 2: 0b000010, 3: 0b000100, 4: 0b001000, 5: 0b010000, 6: 0b100000},
+    # Two-arm box: arm 1 has no camera, arm 5 also fires cam1
+    "2arm": {0: 0b000000, 1: 0b000000, 2: 0b000010, 3: 0b000100, 4: 0b001000, 5: 0b010001, 6: 0b100000},
+}
+
+
+class CameraTrigger:
+    """Drives the arm camera pins from a zone -> bitmask table.
+
+    All pins are written in one batched GPIO.output call, and only when the
+    wanted pin state changes. Every transition is timestamped
+    (time.monotonic_ns) so trigger latency can be measured. verbose prints
+    every change.
+    """
+
+    def __init__(self, gpio, pins, layout, history=10000):
+        self.gpio = gpio
+        self.pins = list(pins)
+        self.layout = layout
+        self.state = 0
+        self.transitions = collections.deque(maxlen=history)
+        self.writes = 0
+        self.verbose = True
+        if self.gpio:
+            self.gpio.setup(self.pins, self.gpio.OUT, initial=self.gpio.LOW)
+
+    def set_zone(self, zone, center):
+        """Sets the pins for the current zone. Returns the camera number logged as 'Camera'."""
+        wanted = self.layout[0 if center else zone]
+        if wanted != self.state:
+            self.write(wanted)
+            if self.verbose:
+                print(f"Zone {0 if center else zone}: cameras " + (", ".join(
+                    str(pin) for i, pin in enumerate(self.pins) if wanted >> i & 1) or "off"))
+        return 0 if center else zone
+
+    def write(self, mask):
+        if self.gpio:
+            values = [self.gpio.HIGH if mask >> i & 1 else self.gpio.LOW for i in range(len(self.pins))]
+            self.gpio.output(self.pins, values)
+        self.state = mask
+        self.writes += 1
+        self.transitions.append((time.monotonic_ns(), mask))
+
+    def off(self):
+        if self.state:
+            self.write(0)
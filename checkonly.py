@@ -1,12 +1,14 @@
 import os
-import shutil
+import sys
 import datetime
-import subprocess
+from backupmanifest import verify_backup, collect_recordings, TARGET_MANIFEST
 
 # Configuration
 source_folder = "/home/lhm403/6armbox/"  # Replace with your actual source folder
 videos_root = "/home/lhm403/6armbox/videos"
 backup_target = "/media/networkshare/6armboxDATA/"
+hash_cache_path = os.path.join(source_folder, "verify_cache.sqlite3")
+verify_workers = 4
 
 cameraname = input("Which camera is this? ").strip()
 
@@ -22,21 +24,21 @@ if not os.path.exists(target_folder):
 else:
     print(f"Folder already exists: {target_folder}")
 
-# Step 2: Move specified file types
-file_extensions = [".csv", ".jpg", ".h264", ".mp4"]
-for ext in file_extensions:
-    print('checking for ', ext, ' files')
-    files = [f for f in os.listdir(source_folder) if f.endswith(ext)]
-
-    for file in files:
-        src_path = os.path.join(source_folder, file)
-        dst_path = os.path.join(target_folder, file)
-        shutil.move(src_path, dst_path)
-        print(f"Moved: {file} to {target_folder}")
-
-# Step 3: Use rclone to copy /videos to /media/6armbox/
-try:
-    subprocess.run(["rclone", "check", "--size-only",  videos_root, backup_target], check=True)
-    print("rclone copy completed successfully.")
-except subprocess.CalledProcessError as e:
-    print(f"rclone failed: {e}")
+# Step 2: Move finished recordings, the same way backuplabdata1 does
+collect_recordings(source_folder, target_folder)
+
+# Step 3: Verify the backup by content against the manifest backuplabdata1 writes
+# next to it. Hashes are cached by (path, size, mtime), so only files that are
+# new or changed on the target since the last check are read.
+if not os.path.exists(os.path.join(backup_target, TARGET_MANIFEST)):
+    sys.exit(f"No {TARGET_MANIFEST} in {backup_target}, so there is nothing to verify against. "
+             "Run backuplabdata1.py first to back up and write the manifest.")
+ok, missing, mismatched = verify_backup(backup_target, hash_cache_path, workers=verify_workers)
+for path in missing:
+    print(f"Missing from backup: {path}")
+for path in mismatched:
+    print(f"Content differs: {path}")
+if missing or mismatched:
+    print(f"Backup check failed: {ok} ok, {len(missing)} missing, {len(mismatched)} differ.")
+else:
+    print(f"Backup check completed successfully: {ok} files verified.")
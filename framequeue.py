@@ -0,0 +1,59 @@
+import threading
+import collections
+
+# Drop policies
+LATEST = "latest"      # drop the oldest queued item to make room (analysis, preview)
+LOSSLESS = "lossless"  # block the producer until there is room (recording, logging)
+
+
+class FrameQueue:
+    """Bounded hand-off between pipeline stages with an explicit drop policy."""
+
+    def __init__(self, maxsize, policy=LATEST, name="queue"):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.name = name
+        self.items = collections.deque()
+        self.lock = threading.Condition()
+        self.closed = False
+        self.put_count = 0
+        self.dropped = 0
+
+    def put(self, item):
+        """Queues an item. Returns False if the queue is closed."""
+        with self.lock:
+            if self.closed:
+                return False
+            if self.policy == LATEST:
+                while len(self.items) >= self.maxsize:
+                    self.items.popleft()
+                    self.dropped += 1
+            else:
+                while len(self.items) >= self.maxsize and not self.closed:
+                    self.lock.wait()
+                if self.closed:
+                    return False
+            self.items.append(item)
+            self.put_count += 1
+            self.lock.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """Returns the next item, or None once the queue is closed and empty (or on timeout)."""
+        with self.lock:
+            if not self.lock.wait_for(lambda: self.items or self.closed, timeout):
+                return None
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.lock.notify_all()
+            return item
+
+    def close(self):
+        """Wakes up all waiting producers/consumers; remaining items can still be drained."""
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+
+    def stats(self):
+        return f"{self.name}: {self.put_count} queued, {self.dropped} dropped"
@@ -0,0 +1,82 @@
+import time
+import cv2
+
+
+class FrameSource:
+    """Where the tracking loop gets its frames from.
+
+    read() returns (frame, gray): a BGR frame and, if the backend gets it for
+    free, its grayscale version (otherwise None). At the end of the stream it
+    returns (None, None). A source that is not live (max-speed replay) waits
+    for the pipeline instead of dropping frames.
+    """
+
+    picam2 = None
+    live = True
+
+    def read(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PicameraSource(FrameSource):
+    """Live picamera2 camera. capture is the script's capture_frame(picam2)."""
+
+    def __init__(self, picam2, capture):
+        self.picam2 = picam2
+        self.capture = capture
+
+    def read(self):
+        return self.capture(self.picam2)
+
+    def close(self):
+        self.picam2.stop()
+
+
+class VideoCaptureSource(FrameSource):
+    """Anything cv2.VideoCapture can open: a USB webcam index or a video file.
+    Frames are resized to size when they come in at a different resolution."""
+
+    def __init__(self, device=0, size=None):
+        self.cap = cv2.VideoCapture(device)
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open video source {device}")
+        self.size = size
+
+    def read(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            return None, None
+        if self.size and (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size)
+        return frame, None
+
+    def close(self):
+        self.cap.release()
+
+
+class ReplaySource(VideoCaptureSource):
+    """Replays a recorded .mp4/.h264 session, either paced at the recording's
+    frame rate (realtime=True) or as fast as frames can be decoded."""
+
+    def __init__(self, path, size=None, realtime=True, fps=24):
+        super().__init__(path, size)
+        # Raw .h264 streams have no container, so there is no frame rate to read back
+        recorded_fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.fps = recorded_fps if recorded_fps and recorded_fps < 1000 else fps
+        self.realtime = realtime
+        self.live = realtime
+        self.start_time = None
+        self.frames_read = 0
+
+    def read(self):
+        if self.realtime:
+            if self.start_time is None:
+                self.start_time = time.monotonic()
+            delay = self.start_time + self.frames_read / self.fps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.frames_read += 1
+        return super().read()
@@ -0,0 +1,128 @@
+import time
+import queue
+import traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+
+def worker_main(shm_name, shape, seq, lock, ready, stop, results, status, model_path, threshold, num_threads,
+                use_xnnpack):
+    # Posts None on status once the model is loaded, or the traceback if loading or inference fails
+    try:
+        run_worker(shm_name, shape, seq, lock, ready, stop, results, status, model_path, threshold, num_threads,
+                   use_xnnpack)
+    except BaseException:
+        status.put(traceback.format_exc())
+        raise
+
+
+def run_worker(shm_name, shape, seq, lock, ready, stop, results, status, model_path, threshold, num_threads,
+               use_xnnpack):
+    # Imported here so inferenceworker itself doesn't need the TFLite runtime
+    from tflitedetect import TFLiteDetector, filter_detections
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frame = np.ndarray(shape, np.uint8, buffer=shm.buf)
+    try:
+        detector = TFLiteDetector(model_path, num_threads=num_threads, use_xnnpack=use_xnnpack)
+        status.put(None)
+        while not stop.is_set():
+            if not ready.wait(0.1):
+                continue
+            with lock:
+                ready.clear()
+                frame_seq = seq.value
+                detector.set_input(frame)
+            start = time.perf_counter()
+            detector.invoke()
+            boxes, classes, scores = filter_detections(*detector.outputs(), threshold)
+            ms = (time.perf_counter() - start) * 1000
+            results.put((frame_seq, boxes, classes, scores, ms))
+    finally:
+        del frame
+        shm.close()
+
+
+class InferenceWorker:
+    """Runs a TFLiteDetector in its own process so inference never blocks capture.
+
+    Frames are handed over through one shared-memory slot: submit() overwrites
+    whatever the worker hasn't picked up yet, so the worker always runs on the
+    most recent frame. Results come back tagged with the frame's sequence
+    number as (seq, boxes, classes, scores, inference_ms), already filtered by
+    threshold; poll() returns the newest one.
+
+    The worker is forked, so the tracker scripts aren't re-imported in it;
+    create it before the camera and other threads are started. The
+    constructor waits until the worker has loaded the model and raises
+    RuntimeError if it couldn't; submit() and poll() raise once the worker
+    has died.
+    """
+
+    def __init__(self, model_path, shape, threshold, num_threads=None, use_xnnpack=True, load_timeout=60):
+        ctx = mp.get_context("fork")
+        self.shape = tuple(shape)
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.shape)))
+        self.frame = np.ndarray(self.shape, np.uint8, buffer=self.shm.buf)
+        self.seq = ctx.Value('q', 0, lock=False)
+        self.lock = ctx.Lock()
+        self.ready = ctx.Event()
+        self.stop = ctx.Event()
+        self.results = ctx.Queue()
+        self.status = ctx.Queue()
+        self.process = ctx.Process(target=worker_main, daemon=True, args=(
+            self.shm.name, self.shape, self.seq, self.lock, self.ready, self.stop, self.results, self.status,
+            model_path, threshold, num_threads, use_xnnpack))
+        self.process.start()
+        self.submitted = 0
+        self.replaced = 0
+        try:
+            error = self.status.get(timeout=load_timeout)
+        except queue.Empty:
+            error = f"model not loaded after {load_timeout} s"
+        if error is not None:
+            self.close()
+            raise RuntimeError(f"Inference worker failed to start: {error}")
+
+    def check_alive(self):
+        if self.process.is_alive():
+            return
+        try:
+            error = self.status.get(timeout=1)
+        except queue.Empty:
+            error = None
+        raise RuntimeError(f"Inference worker exited (code {self.process.exitcode})"
+                           + (f": {error}" if error else ""))
+
+    def submit(self, frame_seq, image):
+        """Hands image (shape as given to the constructor) to the worker."""
+        self.check_alive()
+        with self.lock:
+            if self.ready.is_set():
+                self.replaced += 1
+            np.copyto(self.frame, image)
+            self.seq.value = frame_seq
+            self.ready.set()
+        self.submitted += 1
+
+    def poll(self):
+        """Newest result since the last poll, or None."""
+        latest = None
+        while True:
+            try:
+                latest = self.results.get_nowait()
+            except queue.Empty:
+                break
+        if latest is None:
+            self.check_alive()
+        return latest
+
+    def close(self):
+        self.stop.set()
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        del self.frame
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,43 @@
+import cv2
+import numpy as np
+
+
+class CentroidKalman:
+    """Constant-velocity Kalman filter over the tracked centroid (state x, y, vx, vy;
+    one step per analysed frame). Predicts where to look for the animal next and
+    lets the tracker coast through short dropouts."""
+
+    def __init__(self, process_noise=1e-2, measurement_noise=1.0):
+        self.kf = cv2.KalmanFilter(4, 2)
+        self.kf.transitionMatrix = np.array([[1, 0, 1, 0],
+                                             [0, 1, 0, 1],
+                                             [0, 0, 1, 0],
+                                             [0, 0, 0, 1]], np.float32)
+        self.kf.measurementMatrix = np.array([[1, 0, 0, 0],
+                                              [0, 1, 0, 0]], np.float32)
+        self.kf.processNoiseCov = np.eye(4, dtype=np.float32) * process_noise
+        self.kf.measurementNoiseCov = np.eye(2, dtype=np.float32) * measurement_noise
+        self.active = False
+        self.coasting = 0     # frames since the last measurement
+        self.size = (0, 0)    # last bbox width/height
+
+    def predict(self):
+        """Predicted (x, y) for this frame, or None before the first fix."""
+        if not self.active:
+            return None
+        state = self.kf.predict()
+        return float(state[0, 0]), float(state[1, 0])
+
+    def correct(self, cx, cy, size):
+        if not self.active:
+            self.kf.statePost = np.array([[cx], [cy], [0], [0]], np.float32)
+            self.kf.errorCovPost = np.eye(4, dtype=np.float32)
+            self.active = True
+        else:
+            self.kf.correct(np.array([[cx], [cy]], np.float32))
+        self.coasting = 0
+        self.size = size
+
+    def reset(self):
+        self.active = False
+        self.coasting = 0
@@ -0,0 +1,123 @@
+import time
+import cv2
+import numpy as np
+
+
+class MotionDetector:
+    """Turns a grayscale image into a binary motion/foreground mask.
+
+    Background-model engines are 'continuous': they have to see every frame
+    to keep their model current, and they also find an animal that is
+    resting. Frame differencing only needs the previous frame, so it can be
+    run on demand. Every engine times its own apply() calls.
+    """
+
+    name = "base"
+    continuous = False
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ns = 0
+        self.last_ns = 0
+
+    def apply(self, small, previous=None):
+        start = time.perf_counter_ns()
+        mask = self.compute(small, previous)
+        self.last_ns = time.perf_counter_ns() - start
+        self.total_ns += self.last_ns
+        self.calls += 1
+        return mask
+
+    def compute(self, small, previous):
+        raise NotImplementedError
+
+    def mean_ms(self):
+        return self.total_ns / self.calls / 1e6 if self.calls else 0.0
+
+    def stats(self):
+        return f"Motion detector {self.name}: {self.mean_ms():.3f} ms/frame over {self.calls} frames"
+
+
+class FrameDiffDetector(MotionDetector):
+    """Two-frame differencing (the original find_moving_object_bbox)."""
+
+    name = "diff"
+
+    def __init__(self, threshold=25):
+        super().__init__()
+        self.threshold = threshold
+
+    def compute(self, small, previous):
+        if previous is None:
+            previous = small
+        frame_diff = cv2.absdiff(previous, small)
+        blurred = cv2.GaussianBlur(frame_diff, (5, 5), 0)
+        _, thresh = cv2.threshold(blurred, self.threshold, 255, cv2.THRESH_BINARY)
+        return thresh
+
+
+class SubtractorDetector(MotionDetector):
+    """Wraps an OpenCV BackgroundSubtractor (shadow detection off)."""
+
+    continuous = True
+
+    def __init__(self, subtractor, learning_rate=-1):
+        super().__init__()
+        self.subtractor = subtractor
+        self.learning_rate = learning_rate
+
+    def compute(self, small, previous):
+        foreground = self.subtractor.apply(small, learningRate=self.learning_rate)
+        blurred = cv2.GaussianBlur(foreground, (5, 5), 0)
+        _, thresh = cv2.threshold(blurred, 127, 255, cv2.THRESH_BINARY)
+        return thresh
+
+
+class MOG2Detector(SubtractorDetector):
+    name = "mog2"
+
+    def __init__(self, history=500, var_threshold=16, learning_rate=-1):
+        super().__init__(cv2.createBackgroundSubtractorMOG2(history, var_threshold, False), learning_rate)
+
+
+class KNNDetector(SubtractorDetector):
+    name = "knn"
+
+    def __init__(self, history=500, dist2_threshold=400.0, learning_rate=-1):
+        super().__init__(cv2.createBackgroundSubtractorKNN(history, dist2_threshold, False), learning_rate)
+
+
+class RunningAverageDetector(MotionDetector):
+    """Difference against an exponentially weighted running average of past frames."""
+
+    name = "average"
+    continuous = True
+
+    def __init__(self, alpha=0.02, threshold=25):
+        super().__init__()
+        self.alpha = alpha
+        self.threshold = threshold
+        self.background = None
+
+    def compute(self, small, previous):
+        if self.background is None:
+            self.background = small.astype(np.float32)
+        frame_diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+        cv2.accumulateWeighted(small, self.background, self.alpha)
+        blurred = cv2.GaussianBlur(frame_diff, (5, 5), 0)
+        _, thresh = cv2.threshold(blurred, self.threshold, 255, cv2.THRESH_BINARY)
+        return thresh
+
+
+DETECTORS = {
+    "diff": FrameDiffDetector,
+    "mog2": MOG2Detector,
+    "knn": KNNDetector,
+    "average": RunningAverageDetector,
+}
+
+
+def create_detector(name):
+    if name not in DETECTORS:
+        raise ValueError(f"Unknown motion detector '{name}', expected one of: {', '.join(DETECTORS)}")
+    return DETECTORS[name]()
@@ -9,8 +9,12 @@ import csv
 import threading
 import RPi.GPIO as GPIO
 from picamera2 import Picamera2, Preview
-from tflite_runtime.interpreter import Interpreter
 import re
+import math
+from arena import ArenaMap
+from trackerengines import create_tracker
+from tflitedetect import TFLiteDetector, boxes_to_pixels, box_iou
+from inferenceworker import InferenceWorker
 
 # Constants
 WIDTH, HEIGHT = 640, 480
@@ -31,9 +35,32 @@ cam5 = 24
 cam6 = 25
 lens_pos = 0
 
+# Zone of every pixel, computed once instead of per frame
+ARENA = ArenaMap.hexagonal(WIDTH, HEIGHT, CENTER_RADIUS)
+
 CROP_WIDTH = 480
+CROP_X = (WIDTH - CROP_WIDTH) // 2
 RESIZE_DIM = (320, 320)
 
+# Hybrid detection: TFLite runs every N frames and a cheap OpenCV tracker carries
+# the detection in between. N follows the measured inference time so that, on
+# average, inference costs at most DETECT_BUDGET of each frame period.
+DETECT_THRESHOLD = 0.8
+PROPAGATION_TRACKER = "kcf"
+DETECT_BUDGET = 0.5
+MAX_DETECT_INTERVAL = FPS
+MAX_SIZE_CHANGE = 2.0      # re-detect early if the tracked box grows/shrinks more than this
+RESEED_IOU = 0.3           # async mode: keep the tracker while it overlaps a (late) detection this much
+
+# TFLite interpreter settings
+MODEL_PATH = 'detect.tflite'
+NUM_THREADS = 4
+USE_XNNPACK = True
+
+# Run inference in a worker process; the loop keeps capturing, recording and
+# driving GPIO at camera rate and re-seeds the tracker when results arrive
+ASYNC_INFERENCE = True
+
 # GPIO setup
 GPIO.setmode(GPIO.BCM)
 GPIO.setup(LED_PIN, GPIO.OUT)
@@ -68,39 +95,132 @@ def load_labels(path='labels.txt'):
                 labels[row_number] = pair[0].strip()
     return labels
 
-def set_input_tensor(interpreter, image):
-    """Sets the input tensor."""
-    tensor_index = interpreter.get_input_details()[0]['index']
-    input_tensor = interpreter.tensor(tensor_index)()[0]
-    input_tensor[:, :] = np.expand_dims((image - 255) / 255, axis=0)
-
-
-def get_output_tensor(interpreter, index):
-    """Returns the output tensor at the given index."""
-    output_details = interpreter.get_output_details()[index]
-    tensor = np.squeeze(interpreter.get_tensor(output_details['index']))
-    return tensor
-
-def detect_objects(interpreter, image, threshold):
-    """Returns a list of detection results, each a dictionary of object info."""
-    set_input_tensor(interpreter, image)
-    interpreter.invoke()
-    # Get all output details
-    boxes = get_output_tensor(interpreter, 0)
-    classes = get_output_tensor(interpreter, 1)
-    scores = get_output_tensor(interpreter, 2)
-    count = int(get_output_tensor(interpreter, 3))
-
-    results = []
-    for i in range(count):
-        if scores[i] >= threshold:
-            result = {
-                'bounding_box': boxes[i],
-                'class_id': classes[i],
-                'score': scores[i]
-            }
-            results.append(result)
-    return results
+def boxes_to_frame(boxes):
+    """Normalised (ymin, xmin, ymax, xmax) rows from the cropped model input to
+    full-frame pixel (xmin, ymin, xmax, ymax) rows."""
+    return boxes_to_pixels(boxes, (CROP_WIDTH, HEIGHT), (CROP_X, 0), (WIDTH, HEIGHT))
+
+def best_box(boxes, scores):
+    """Full-frame (xmin, ymin, xmax, ymax) of the top-scoring detection (single animal)."""
+    best = scores.argmax()
+    return tuple(int(v) for v in boxes_to_frame(boxes[best:best + 1])[0])
+
+class DetectionPropagator:
+    """Runs TFLite detection every `interval` frames and propagates the best
+    detection with an OpenCV tracker on the frames in between.
+
+    Detection is re-run early when the tracker fails or its box changes size
+    too much, and on every frame while nothing is being tracked.
+    """
+
+    def __init__(self, detector, threshold=DETECT_THRESHOLD, tracker=PROPAGATION_TRACKER,
+                 budget=DETECT_BUDGET, max_interval=MAX_DETECT_INTERVAL):
+        self.detector = detector
+        self.threshold = threshold
+        self.tracker_name = tracker
+        self.budget_ms = budget * 1000 / FPS
+        self.max_interval = max_interval
+        self.interval = 1
+        self.infer_ms = None
+        self.tracker = None
+        self.since_detection = 0
+        self.detected_area = 0
+        self.detections = 0
+        self.propagated = 0
+
+    def detect(self, frame, resized_frame):
+        start = time.perf_counter()
+        boxes, classes, scores = self.detector.detect(resized_frame, self.threshold)
+        ms = (time.perf_counter() - start) * 1000
+        self.infer_ms = ms if self.infer_ms is None else 0.8 * self.infer_ms + 0.2 * ms
+        self.interval = min(max(math.ceil(self.infer_ms / self.budget_ms), 1), self.max_interval)
+        self.detections += 1
+        self.since_detection = 0
+        if len(scores) == 0:
+            self.tracker = None
+            return None
+        xmin, ymin, xmax, ymax = best_box(boxes, scores)
+        self.tracker = create_tracker(self.tracker_name)
+        self.tracker.init(frame, (xmin, ymin, xmax - xmin, ymax - ymin))
+        self.detected_area = max((xmax - xmin) * (ymax - ymin), 1)
+        return xmin, ymin, xmax, ymax
+
+    def update(self, frame, resized_frame):
+        """Box of the animal in full-frame pixels (xmin, ymin, xmax, ymax), or None."""
+        self.since_detection += 1
+        if self.tracker is None or self.since_detection >= self.interval:
+            return self.detect(frame, resized_frame)
+        success, bbox = self.tracker.update(frame)
+        if not success:
+            return self.detect(frame, resized_frame)
+        x, y, w, h = map(int, bbox)
+        change = w * h / self.detected_area
+        if change > MAX_SIZE_CHANGE or change < 1 / MAX_SIZE_CHANGE:
+            return self.detect(frame, resized_frame)
+        self.propagated += 1
+        return max(x, 1), max(y, 1), min(x + w, WIDTH), min(y + h, HEIGHT)
+
+    def stats(self):
+        return (f"TFLite detection on {self.detections} frames ({self.infer_ms or 0:.1f} ms each, "
+                f"every {self.interval} frames), tracker on {self.propagated}")
+
+class AsyncDetectionPropagator:
+    """DetectionPropagator counterpart for an InferenceWorker: every frame is
+    offered to the worker (which keeps only the newest). Results come back a
+    few frames old, so a detection only re-seeds the tracker (on the current
+    frame) when the tracker has failed or its box overlaps the detection by
+    less than RESEED_IOU; otherwise the tracker's up-to-date box is kept."""
+
+    def __init__(self, worker, tracker=PROPAGATION_TRACKER):
+        self.worker = worker
+        self.tracker_name = tracker
+        self.tracker = None
+        self.frame_seq = 0
+        self.last_result_seq = 0
+        self.results = 0
+        self.reseeds = 0
+        self.latency_frames = 0
+        self.infer_ms = None
+
+    def update(self, frame, resized_frame):
+        """Box of the animal in full-frame pixels (xmin, ymin, xmax, ymax), or None."""
+        self.frame_seq += 1
+        self.worker.submit(self.frame_seq, resized_frame)
+        tracked = None
+        if self.tracker is not None:
+            success, bbox = self.tracker.update(frame)
+            if success:
+                x, y, w, h = map(int, bbox)
+                tracked = max(x, 1), max(y, 1), min(x + w, WIDTH), min(y + h, HEIGHT)
+            else:
+                self.tracker = None
+
+        result = self.worker.poll()
+        if result is None or result[0] <= self.last_result_seq:
+            return tracked
+        result_seq, boxes, classes, scores, ms = result
+        self.last_result_seq = result_seq
+        self.results += 1
+        self.latency_frames += self.frame_seq - result_seq
+        self.infer_ms = ms if self.infer_ms is None else 0.8 * self.infer_ms + 0.2 * ms
+        if len(scores) == 0:
+            self.tracker = None
+            return None
+        detected = best_box(boxes, scores)
+        if tracked is not None and box_iou(tracked, detected) >= RESEED_IOU:
+            return tracked
+        xmin, ymin, xmax, ymax = detected
+        self.tracker = create_tracker(self.tracker_name)
+        self.tracker.init(frame, (xmin, ymin, xmax - xmin, ymax - ymin))
+        self.reseeds += 1
+        return xmin, ymin, xmax, ymax
+
+    def stats(self):
+        latency = self.latency_frames / self.results if self.results else 0.0
+        return (f"TFLite worker returned {self.results} results for {self.frame_seq} frames, "
+                f"{self.reseeds} of them re-seeded the tracker "
+                f"({self.infer_ms or 0:.1f} ms each, {latency:.1f} frames behind, "
+                f"{self.worker.replaced} frames replaced before inference)")
 
 def led_flashing():
     global led_thread_running
@@ -148,17 +268,6 @@ def draw_zones(frame):
         cv2.drawContours(frame, [np.array([pt1, pt2, pt3])], 0, (0, 255, 0), 1)
     cv2.circle(frame, center, CENTER_RADIUS, (255, 0, 0), 1)
 
-def determine_piezone(cx, cy):
-    dx = cx - WIDTH // 2
-    dy = cy - HEIGHT // 2
-    angle = (np.arctan2(dy, dx) * 180 / np.pi) % 360
-    return int(angle // 60) + 1
-
-def in_center(cx, cy):
-    dx = cx - WIDTH // 2
-    dy = cy - HEIGHT // 2
-    return dx * dx + dy * dy <= CENTER_RADIUS * CENTER_RADIUS
-
 
 def generate_filename(base_time, sample_number, session_number, suffix):
     timestamp = base_time.strftime("%Y%m%d_%H%M%S")
@@ -172,9 +281,14 @@ def main():
     session_number = 1
 
     labels = load_labels()
-    interpreter = Interpreter('detect.tflite')
-    interpreter.allocate_tensors()
-    _, input_height, input_width, _ = interpreter.get_input_details()[0]['shape']
+    worker = None
+    if ASYNC_INFERENCE:
+        worker = InferenceWorker(MODEL_PATH, (RESIZE_DIM[1], RESIZE_DIM[0], 3), DETECT_THRESHOLD,
+                                 num_threads=NUM_THREADS, use_xnnpack=USE_XNNPACK)
+        propagator = AsyncDetectionPropagator(worker)
+    else:
+        detector = TFLiteDetector(MODEL_PATH, num_threads=NUM_THREADS, use_xnnpack=USE_XNNPACK)
+        propagator = DetectionPropagator(detector)
 
     picam2 = initialize_camera()
     print("Press spacebar to start tracking...")
@@ -204,9 +318,9 @@ def main():
     while True:
         frame = picam2.capture_array()
 
-        cropped_frame = frame[:, 80:560]
+        cropped_frame = frame[:, CROP_X:CROP_X + CROP_WIDTH]
         resized_frame = cv2.resize(cropped_frame, RESIZE_DIM)
-        res = detect_objects(interpreter, resized_frame, 0.8)
+        box = propagator.update(frame, resized_frame)
 
         draw_zones(resized_frame)
         timestamp = datetime.datetime.now()
@@ -216,23 +330,17 @@ def main():
         prev_time = current_time
         fps = 0.9 * fps + 0.1 * (1.0 / dt)
 
-        for result in res:
-            ymin, xmin, ymax, xmax = result['bounding_box']
-            xmin = int(max(1, xmin * WIDTH))
-            xmax = int(min(WIDTH, xmax * WIDTH))
-            ymin = int(max(1, ymin * HEIGHT))
-            ymax = int(min(HEIGHT, ymax * HEIGHT))
-
+        if box is not None:
+            xmin, ymin, xmax, ymax = box
             cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 255, 0), 3)
 
             # Draw circle in center
-            xcenter = xmin + (int(round((xmax - xmin) / 2)))  # something wrong here....need to troubleshoot. will figure this out later.
+            xcenter = xmin + (int(round((xmax - xmin) / 2)))
             ycenter = ymin + (int(round((ymax - ymin) / 2)))
             cv2.circle(frame, (xcenter, ycenter), 5, (0, 0, 255), thickness=-1)
         if not paused:
-            if xcenter > 0:
-                zone = determine_piezone(xcenter, ycenter)
-                center = in_center(xcenter, ycenter)
+            if box is not None:
+                zone, center = ARENA.classify(xcenter, ycenter)
                 print(f"Object in piezone {zone}" + (" and centerzone" if center else ""))
                 if center:
                     # GPIO.output(cam1,GPIO.LOW)
@@ -300,8 +408,8 @@ def main():
                         print('GPIO ', cam6, ' triggered')
 
 
-                cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
-                cv2.circle(frame, (cx, cy), 5, (0, 0, 255), -1)
+                cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (255, 0, 0), 2)
+                cv2.circle(frame, (xcenter, ycenter), 5, (0, 0, 255), -1)
                 cv2.putText(frame, f"Zone {zone}" + (" + Center" if center else ""), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
                 log_writer.writerow([frame_count, timestamp.strftime("%H:%M:%S.%f"), zone, center, round(fps, 2), cameratriggered])
             else:
@@ -361,6 +469,9 @@ def main():
 
 
 
+    print(propagator.stats())
+    if worker:
+        worker.close()
     if video_writer:
         video_writer.release()
     if log_file:
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Remuxes finished raw .h264 recordings into MP4/MKV without re-encoding.
+
+Runs at the lowest CPU and I/O priority, one job at a time by default, and
+starts nothing while a recording is still being written. A remuxed file is
+only kept if it has the same number of frames as the raw stream; it is then
+left in the watch folder (where backuplabdata1 collects it) and the raw
+stream is moved to raw/ or deleted. Streams that fail to remux or verify are
+moved to failed/. backuplabdata1 collects both folders, and leaves .h264
+files in the watch folder alone while the daemon's heartbeat file is fresh.
+
+    nohup python3 remuxdaemon.py /home/lhm403/6armbox &
+"""
+
+import os
+import time
+import shutil
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+FRAMERATE = 30              # picamera2 video default; used when there is no pts file
+CONTAINER = "mp4"
+POLL_SECONDS = 10
+SETTLE_SECONDS = 15         # a .h264 untouched this long is treated as closed
+MAX_JOBS = 1
+KEEP_RAW = True             # move verified raw streams to raw/ instead of deleting them
+HEARTBEAT_FILE = ".remuxdaemon"   # touched every poll while the daemon runs
+
+# Run every tool at idle CPU and I/O priority where available
+LOW_PRIORITY = (["nice", "-n", "19"] if shutil.which("nice") else []) + \
+               (["ionice", "-c", "3"] if shutil.which("ionice") else [])
+
+
+def pts_file(path):
+    """Timestamp file written next to a recording (picamera2 pts=), or None.
+    Simecam6 names it <video>_pts.txt, Retrack15 <base>_pts.txt for <base>_video.h264."""
+    stem = os.path.splitext(path)[0]
+    for candidate in (stem + "_pts.txt", stem.rsplit("_video", 1)[0] + "_pts.txt"):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def daemon_running(folder):
+    """True if a remuxdaemon is watching folder (its heartbeat file is fresh)."""
+    try:
+        age = time.time() - os.stat(os.path.join(folder, HEARTBEAT_FILE)).st_mtime
+    except FileNotFoundError:
+        return False
+    return age < 3 * POLL_SECONDS
+
+
+def set_aside(path, subfolder):
+    """Moves a raw stream and its pts file into subfolder next to it."""
+    folder = os.path.join(os.path.dirname(path), subfolder)
+    os.makedirs(folder, exist_ok=True)
+    for companion in [path] + [p for p in [pts_file(path)] if p]:
+        shutil.move(companion, os.path.join(folder, os.path.basename(companion)))
+
+
+def count_packets(path):
+    """Video frames in a file, counted from packets (no decoding)."""
+    output = subprocess.run(LOW_PRIORITY + [
+        "ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+        "-show_entries", "stream=nb_read_packets", "-of", "csv=p=0", path],
+        check=True, capture_output=True, text=True).stdout
+    return int(output.strip().splitlines()[0])
+
+
+def remux(path, container=CONTAINER, framerate=FRAMERATE):
+    """Writes <stem>.<container> next to path; returns its name. With a pts file and
+    mkvmerge available the real capture timestamps are used (MKV), otherwise
+    ffmpeg stamps a constant frame rate."""
+    stem = os.path.splitext(path)[0]
+    timestamps = pts_file(path)
+    if timestamps and shutil.which("mkvmerge"):
+        output = stem + ".mkv"
+        command = ["mkvmerge", "-q", "-o", output + ".part", "--timestamps", f"0:{timestamps}", path]
+    else:
+        output = f"{stem}.{container}"
+        command = ["ffmpeg", "-v", "error", "-y", "-framerate", str(framerate), "-i", path,
+                   "-c", "copy", "-f", "matroska" if container == "mkv" else container, output + ".part"]
+    subprocess.run(LOW_PRIORITY + command, check=True)
+    os.replace(output + ".part", output)
+    return output
+
+
+def process(path, keep_raw=KEEP_RAW):
+    # OSError covers a missing ffmpeg/ffprobe and files moved away mid-job;
+    # the daemon must keep running either way
+    try:
+        output = remux(path)
+        expected, actual = count_packets(path), count_packets(output)
+    except (subprocess.CalledProcessError, ValueError, IndexError, OSError) as e:
+        print(f"Remux of {path} failed: {e}")
+        return False
+    if expected != actual:
+        print(f"Remux of {path} has {actual} frames instead of {expected}; keeping the raw stream")
+        try:
+            os.remove(output)
+        except OSError:
+            pass
+        return False
+
+    try:
+        if keep_raw:
+            set_aside(path, "raw")
+        else:
+            for companion in [path] + [p for p in [pts_file(path)] if p]:
+                os.remove(companion)
+    except OSError as e:
+        print(f"Remuxed {path} but could not clear the raw stream: {e}")
+        return False
+    print(f"Remuxed {path} -> {output} ({actual} frames)")
+    return True
+
+
+def raw_streams(folder):
+    """(path, seconds since last write) of every .h264 directly in folder."""
+    now = time.time()
+    with os.scandir(folder) as entries:
+        return [(entry.path, now - entry.stat().st_mtime) for entry in entries
+                if entry.is_file() and entry.name.endswith(".h264")]
+
+
+def watch(folder, jobs=MAX_JOBS, keep_raw=KEEP_RAW):
+    os.nice(19)
+    running = {}
+    failed = set()
+    heartbeat = os.path.join(folder, HEARTBEAT_FILE)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while True:
+            with open(heartbeat, "a"):
+                os.utime(heartbeat)
+            for path in [path for path, future in running.items() if future.done()]:
+                if running.pop(path).result():
+                    continue
+                # Handed to backuplabdata1 as it is; only kept here if even that fails
+                try:
+                    set_aside(path, "failed")
+                    print(f"Moved {path} to failed/")
+                except OSError as e:
+                    print(f"Could not move {path} to failed/: {e}")
+                    failed.add(path)
+            streams = raw_streams(folder)
+            recording = any(age < SETTLE_SECONDS for _, age in streams)
+            # Leave the card and CPU to the camera while anything is being recorded
+            if not recording:
+                for path, _ in sorted(streams):
+                    if len(running) >= jobs:
+                        break
+                    if path not in running and path not in failed:
+                        running[path] = pool.submit(process, path, keep_raw)
+            time.sleep(POLL_SECONDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('folder', help='Folder the sidecam writes its .h264 files to')
+    parser.add_argument('--jobs', type=int, default=MAX_JOBS, help='Remuxes running at the same time')
+    parser.add_argument('--delete-raw', action='store_true', help='Delete raw streams once verified')
+    args = parser.parse_args()
+    watch(args.folder, args.jobs, not args.delete_raw)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import queue
+import socket
+import threading
+import cv2
+
+COMMANDS = ("start", "pause", "resume", "quit")
+
+# Keys used in the preview window
+KEY_COMMANDS = {ord(' '): "start", ord('m'): "pause", ord('c'): "resume", ord('q'): "quit"}
+
+
+class SessionControl:
+    """Session commands (start, pause, resume, quit) from the preview window's
+    keys, stdin lines and/or a local UNIX socket, plus an optional preview.
+
+    preview_fps=None shows every frame (the old behaviour), 0 runs headless
+    with no window at all, and N shows at most N preview frames per second.
+    cv2.waitKey is only called when a preview frame is actually shown.
+
+    Over SSH:   echo pause | socat - UNIX-CONNECT:/tmp/6armbox.sock
+    """
+
+    def __init__(self, preview_fps=None, stdin=False, socket_path=None, window="Tracking"):
+        self.preview_fps = preview_fps
+        self.window = window
+        self.commands = queue.Queue()
+        self.last_preview = 0.0
+        self.socket_path = socket_path
+        self.server = None
+        if stdin:
+            threading.Thread(target=self.read_stream, args=(sys.stdin,), daemon=True).start()
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(socket_path)
+            self.server.listen(1)
+            threading.Thread(target=self.serve, daemon=True).start()
+            print(f"Listening for commands on {socket_path}")
+
+    def add(self, line):
+        command = line.strip().lower()
+        if command in COMMANDS:
+            self.commands.put(command)
+            return True
+        if command:
+            print(f"Unknown command '{command}', expected one of: {', '.join(COMMANDS)}")
+        return False
+
+    def read_stream(self, stream):
+        for line in stream:
+            self.add(line)
+
+    def serve(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            with connection, connection.makefile("rw") as stream:
+                for line in stream:
+                    stream.write("ok\n" if self.add(line) else "unknown command\n")
+                    stream.flush()
+
+    def preview_due(self):
+        """True if a frame passed to poll() right now would be shown."""
+        if self.preview_fps is None:
+            return True
+        if self.preview_fps <= 0:
+            return False
+        return time.monotonic() - self.last_preview >= 1.0 / self.preview_fps
+
+    def poll(self, frame=None):
+        """Shows frame if a preview is due and returns the next command, or None."""
+        if frame is not None and self.preview_due():
+            self.last_preview = time.monotonic()
+            cv2.imshow(self.window, frame)
+            key = cv2.waitKey(1) & 0xFF
+            if key in KEY_COMMANDS:
+                self.commands.put(KEY_COMMANDS[key])
+        try:
+            return self.commands.get_nowait()
+        except queue.Empty:
+            return None
+
+    def close(self):
+        if self.server:
+            self.server.close()
+            os.remove(self.socket_path)
@@ -0,0 +1,89 @@
+import os
+import csv
+import queue
+import datetime
+import threading
+import numpy as np
+
+LOG_DTYPE = np.dtype([
+    ("frame", np.int64),
+    ("wall_ns", np.int64),    # time.time_ns() at capture
+    ("mono_ns", np.int64),    # time.monotonic_ns() at capture
+    ("piezone", np.uint8),    # 0 = not tracked
+    ("in_center", np.bool_),
+    ("fps", np.float32),
+    ("camera", np.int16),
+])
+
+CSV_HEADER = ["Frame", "Timestamp", "Piezone", "InCenter", "FPS", "Camera"]
+
+
+class SessionLog:
+    """Per-frame session log kept in preallocated NumPy record buffers.
+
+    Full buffers are written by a background thread to <base>.bin (raw
+    LOG_DTYPE records, readable with np.fromfile if a session is cut short).
+    close() turns that into <base>.npy and, if export_csv is set, the usual
+    <base>.csv with the Frame/Timestamp/Piezone/InCenter/FPS/Camera columns.
+    """
+
+    def __init__(self, base, chunk_rows=4096, buffers=3, export_csv=True):
+        self.bin_path = base + ".bin"
+        self.npy_path = base + ".npy"
+        self.csv_path = base + ".csv"
+        self.export_csv = export_csv
+        self.free_buffers = queue.Queue()
+        for _ in range(buffers):
+            self.free_buffers.put(np.zeros(chunk_rows, LOG_DTYPE))
+        self.flush_queue = queue.Queue()
+        self.buffer = self.free_buffers.get()
+        self.count = 0
+        self.file = open(self.bin_path, "wb")
+        self.thread = threading.Thread(target=self.flush_loop, daemon=True)
+        self.thread.start()
+
+    def append(self, frame, wall_ns, mono_ns, piezone, in_center, fps, camera):
+        self.buffer[self.count] = (frame, wall_ns, mono_ns, piezone, in_center, fps, camera)
+        self.count += 1
+        if self.count == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        """Hands the current buffer to the writer thread."""
+        if self.count:
+            self.flush_queue.put((self.buffer, self.count))
+            self.buffer = self.free_buffers.get()
+            self.count = 0
+
+    def flush_loop(self):
+        while True:
+            item = self.flush_queue.get()
+            if item is None:
+                break
+            buffer, count = item
+            buffer[:count].tofile(self.file)
+            self.file.flush()
+            self.free_buffers.put(buffer)
+
+    def close(self):
+        self.flush()
+        self.flush_queue.put(None)
+        self.thread.join()
+        self.file.close()
+        records = np.fromfile(self.bin_path, LOG_DTYPE)
+        np.save(self.npy_path, records)
+        os.remove(self.bin_path)
+        if self.export_csv:
+            export_csv(records, self.csv_path)
+        return records
+
+
+def export_csv(records, path):
+    """Writes log records as the CSV the tracker used to write frame by frame."""
+    with open(path, mode='w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        for row in records:
+            timestamp = datetime.datetime.fromtimestamp(int(row["wall_ns"]) / 1e9)
+            writer.writerow([int(row["frame"]), timestamp.strftime("%H:%M:%S.%f"), int(row["piezone"]),
+                             bool(row["in_center"]), round(float(row["fps"]), 2), int(row["camera"])])
@@ -0,0 +1,195 @@
+import importlib.util
+import cv2
+import numpy as np
+
+# tflite_runtime on the Pi, full TensorFlow elsewhere
+if importlib.util.find_spec('tflite_runtime'):
+    from tflite_runtime import interpreter as tflite
+else:
+    from tensorflow import lite as tflite
+
+# Input normalisation the model was trained with, (pixel - mean) / std: [-1, 1] by
+# default, pass input_mean=0, input_std=255 for [0, 1] models
+INPUT_MEAN = 127.5
+INPUT_STD = 127.5
+
+
+class TFLiteDetector:
+    """SSD-style TFLite detector with everything that doesn't change per frame
+    (tensor indices, input shape, dtype and quantization, output order) looked
+    up once at load time.
+
+    set_input() writes pixels straight into the interpreter's input buffer in
+    the model's own dtype. Float models get (pixel - input_mean) / input_std,
+    quantized models that value quantized with the input's scale and zero
+    point. When that works out to the raw pixels (or the pixels shifted by a
+    constant) to within one step, as it does for the usual uint8/int8 SSD
+    models, the pixels are copied (resized in place if needed) or shifted
+    instead; everything else goes through a float32 scratch buffer.
+
+    num_threads is passed to the interpreter; use_xnnpack=False builds it
+    without the default (XNNPACK) delegate for comparison.
+    """
+
+    def __init__(self, model_path, num_threads=None, use_xnnpack=True, delegates=None,
+                 input_mean=INPUT_MEAN, input_std=INPUT_STD):
+        kwargs = {"model_path": model_path, "num_threads": num_threads}
+        if delegates:
+            kwargs["experimental_delegates"] = delegates
+        if not use_xnnpack:
+            resolver = getattr(tflite, "OpResolverType", None) or tflite.experimental.OpResolverType
+            kwargs["experimental_op_resolver_type"] = resolver.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        self.interpreter = tflite.Interpreter(**kwargs)
+        self.interpreter.allocate_tensors()
+
+        input_details = self.interpreter.get_input_details()[0]
+        self.input_index = input_details['index']
+        _, self.height, self.width, _ = input_details['shape']
+        self.input_dtype = input_details['dtype']
+        self.input_scale, self.input_zero_point = input_details['quantization']
+        self.input_mean = input_mean
+        self.input_std = input_std
+
+        # Quantized input as pixel * gain + offset; shift is set when pixel + shift
+        # is within one quantization step of that over the whole 0..255 range
+        self.gain = self.offset = self.shift = None
+        if self.input_scale:
+            self.gain = 1.0 / (input_std * self.input_scale)
+            self.offset = self.input_zero_point - input_mean * self.gain
+            shift = int(round(self.offset))
+            error = max(abs(pixel * (self.gain - 1) + self.offset - shift) for pixel in (0, 255))
+            if error <= 1:
+                self.shift = shift
+        elif self.input_dtype == np.uint8:
+            self.shift = 0      # unquantized uint8 input: raw pixels
+        self.scratch = None
+        self.float_scratch = None
+        if not (self.input_dtype == np.uint8 and self.shift == 0):
+            self.scratch = np.empty((self.height, self.width, 3), np.uint8)
+        if self.input_scale and self.shift is None:
+            self.float_scratch = np.empty((self.height, self.width, 3), np.float32)
+
+        output_details = self.interpreter.get_output_details()
+        # TF2 exported models order their outputs differently from TF1 ones
+        if 'StatefulPartitionedCall' in output_details[0]['name']:
+            order = (1, 3, 0, 2)
+        else:
+            order = (0, 1, 2, 3)
+        self.boxes_index, self.classes_index, self.scores_index, self.count_index = \
+            (output_details[i]['index'] for i in order)
+
+    @property
+    def input_size(self):
+        return int(self.width), int(self.height)
+
+    def set_input(self, image):
+        """Copies (and if needed resizes) a HxWx3 uint8 image into the input tensor."""
+        # The tensor view must not outlive this call: invoke() may move the buffer
+        tensor = self.interpreter.tensor(self.input_index)()[0]
+        if self.input_dtype == np.uint8 and self.shift == 0:
+            if image.shape[:2] == (self.height, self.width):
+                np.copyto(tensor, image)
+            else:
+                cv2.resize(image, self.input_size, dst=tensor)
+            return
+        pixels = image
+        if image.shape[:2] != (self.height, self.width):
+            pixels = cv2.resize(image, self.input_size, dst=self.scratch)
+        if self.shift is not None:
+            limits = np.iinfo(self.input_dtype)
+            if limits.min <= self.shift and 255 + self.shift <= limits.max:
+                # e.g. int8 models: pixel - 128, straight into the tensor
+                np.add(pixels, self.shift, out=tensor, dtype=np.int16, casting='unsafe')
+            else:
+                shifted = np.add(pixels, self.shift, dtype=np.int16)
+                np.clip(shifted, limits.min, limits.max, out=shifted)
+                np.copyto(tensor, shifted, casting='unsafe')
+        elif self.input_scale:
+            values = self.float_scratch
+            np.multiply(pixels, self.gain, out=values, dtype=np.float32)
+            values += self.offset
+            np.rint(values, out=values)
+            limits = np.iinfo(self.input_dtype)
+            np.clip(values, limits.min, limits.max, out=values)
+            np.copyto(tensor, values, casting='unsafe')
+        else:
+            np.subtract(pixels, self.input_mean, out=tensor, dtype=np.float32)
+            tensor *= 1.0 / self.input_std
+
+    def invoke(self):
+        self.interpreter.invoke()
+
+    def outputs(self):
+        """(boxes, classes, scores, count) of the last invoke()."""
+        get_tensor = self.interpreter.get_tensor
+        boxes = get_tensor(self.boxes_index)[0]
+        classes = get_tensor(self.classes_index)[0]
+        scores = get_tensor(self.scores_index)[0]
+        count = int(get_tensor(self.count_index)[0])
+        return boxes, classes, scores, count
+
+    def detect(self, image, threshold):
+        """(boxes, classes, scores) arrays of the detections scoring at least threshold."""
+        self.set_input(image)
+        self.invoke()
+        return filter_detections(*self.outputs(), threshold)
+
+
+def filter_detections(boxes, classes, scores, count, threshold):
+    """Keeps the first count detections that score at least threshold."""
+    keep = scores[:count] >= threshold
+    return boxes[:count][keep], classes[:count][keep], scores[:count][keep]
+
+
+def boxes_to_pixels(boxes, size, offset=(0, 0), bounds=None):
+    """Normalised (ymin, xmin, ymax, xmax) rows to int32 pixel (xmin, ymin, xmax, ymax) rows.
+
+    size is the (width, height) of the image the model saw, offset where that
+    image starts in the frame and bounds the frame (width, height) to clip to
+    (by default the model image itself).
+    """
+    width, height = size
+    if bounds is None:
+        bounds = (offset[0] + width, offset[1] + height)
+    pixels = boxes[:, [1, 0, 3, 2]] * (width, height, width, height) + tuple(offset) * 2
+    np.clip(pixels, 1, tuple(bounds) * 2, out=pixels)
+    return pixels.astype(np.int32)
+
+
+def centroids(pixel_boxes):
+    """(x, y) centre of every (xmin, ymin, xmax, ymax) row."""
+    return (pixel_boxes[:, :2] + pixel_boxes[:, 2:]) // 2
+
+
+def box_iou(a, b):
+    """Intersection over union of two (xmin, ymin, xmax, ymax) boxes."""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    overlap = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - overlap
+    return float(overlap / union) if union > 0 else 0.0
+
+
+def non_max_suppression(boxes, scores, iou_threshold=0.5):
+    """Indices of the boxes kept by greedy NMS, best first. All IoUs are computed
+    in one go; the loop only walks the (few) surviving boxes."""
+    if len(scores) == 0:
+        return np.empty(0, np.intp)
+    boxes = np.asarray(boxes, np.float32)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    top_left = np.maximum(boxes[:, None, :2], boxes[None, :, :2])
+    bottom_right = np.minimum(boxes[:, None, 2:], boxes[None, :, 2:])
+    overlap = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    iou = overlap / np.maximum(areas[:, None] + areas[None, :] - overlap, 1e-9)
+
+    order = np.argsort(-scores)
+    suppressed = np.zeros(len(scores), bool)
+    keep = []
+    for i in order:
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= iou[i] > iou_threshold
+    return np.array(keep, np.intp)
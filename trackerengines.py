@@ -0,0 +1,114 @@
+import time
+import cv2
+
+# Engine name -> OpenCV factory name. Depending on the OpenCV build a factory
+# lives in cv2, in cv2.legacy (opencv-contrib >= 4.5.1), or in both.
+TRACKERS = {
+    "csrt": "TrackerCSRT_create",
+    "kcf": "TrackerKCF_create",
+    "mil": "TrackerMIL_create",
+    "boosting": "TrackerBoosting_create",
+    "tld": "TrackerTLD_create",
+    "medianflow": "TrackerMedianFlow_create",
+    "mosse": "TrackerMOSSE_create",
+}
+
+
+def tracker_factory(name):
+    """Returns the OpenCV factory for an engine, or None if this build doesn't have it."""
+    factory_name = TRACKERS[name]
+    factory = getattr(cv2, factory_name, None)
+    if factory is None and hasattr(cv2, "legacy"):
+        factory = getattr(cv2.legacy, factory_name, None)
+    return factory
+
+
+def available_trackers():
+    return [name for name in TRACKERS if tracker_factory(name)]
+
+
+def create_tracker(name):
+    if name not in TRACKERS:
+        raise ValueError(f"Unknown tracker '{name}', expected one of: {', '.join(TRACKERS)}")
+    factory = tracker_factory(name)
+    if factory is None:
+        raise ValueError(f"Tracker '{name}' is not available in this OpenCV build")
+    return factory()
+
+
+class AdaptiveTracker:
+    """A tracker that steps down a ladder of engines (most to least expensive)
+    when updates blow the per-frame budget, and back up when there is headroom.
+
+    Works like an OpenCV tracker (init/update). Every init() builds a fresh
+    engine, so the object can be kept and re-initialised when the animal is
+    re-detected; the chosen engine and its timing history survive that.
+    """
+
+    def __init__(self, ladder, start, budget_ms, downgrade_after=5, upgrade_after=120, headroom=0.4):
+        self.ladder = [name for name in ladder if tracker_factory(name)]
+        if not self.ladder:
+            raise ValueError(f"None of the trackers {ladder} are available in this OpenCV build")
+        if start not in self.ladder:
+            raise ValueError(f"Tracker '{start}' is not one of the available engines {self.ladder}")
+        self.level = self.ladder.index(start)
+        self.budget_ms = budget_ms
+        self.downgrade_after = downgrade_after
+        self.upgrade_after = upgrade_after
+        self.headroom = headroom
+        self.tracker = None
+        self.last_bbox = None
+        self.ema_ms = None
+        self.over = 0
+        self.under = 0
+        self.switches = []
+
+    @property
+    def name(self):
+        return self.ladder[self.level]
+
+    def init(self, frame, bbox):
+        self.tracker = create_tracker(self.name)
+        self.tracker.init(frame, tuple(int(v) for v in bbox))
+        self.last_bbox = bbox
+
+    def update(self, frame):
+        start = time.perf_counter()
+        success, bbox = self.tracker.update(frame)
+        ms = (time.perf_counter() - start) * 1000
+        self.ema_ms = ms if self.ema_ms is None else 0.8 * self.ema_ms + 0.2 * ms
+
+        if self.ema_ms > self.budget_ms:
+            self.over += 1
+            self.under = 0
+        elif self.ema_ms < self.budget_ms * self.headroom:
+            self.under += 1
+            self.over = 0
+        else:
+            self.over = 0
+            self.under = 0
+
+        if success:
+            self.last_bbox = bbox
+        if self.over >= self.downgrade_after and self.level < len(self.ladder) - 1:
+            self.switch(self.level + 1, frame if success else None)
+        elif self.under >= self.upgrade_after and self.level > 0:
+            self.switch(self.level - 1, frame if success else None)
+        return success, bbox
+
+    def switch(self, level, frame):
+        old = self.name
+        ema_ms = self.ema_ms
+        # An engine we just climbed to that can't keep up: wait longer before trying again
+        if level > self.level and self.switches:
+            _, previous_from, previous_to, _ = self.switches[-1]
+            if previous_to == old and self.ladder.index(previous_from) > self.level:
+                self.upgrade_after *= 2
+        self.level = level
+        self.switches.append((time.time(), old, self.name, round(ema_ms, 2)))
+        print(f"Tracker {old} -> {self.name}: {ema_ms:.1f} ms/frame against a {self.budget_ms:.1f} ms budget")
+        self.ema_ms = None
+        self.over = 0
+        self.under = 0
+        if frame is not None:
+            self.init(frame, self.last_bbox)